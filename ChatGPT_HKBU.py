@@ -1,14 +1,30 @@
+import asyncio
 import configparser
-import requests
+import datetime
+import json
 import os
 import random
-from collections import defaultdict, deque
-from google.cloud import firestore
-from google.cloud.firestore_v1 import SERVER_TIMESTAMP
-import re
+import threading
+import time
+from collections import OrderedDict
+
+from context_window import ContextBuilder
+from event_index import EventKeywordIndex
+from firestore_writer import FirestoreWriteBehind
+from http_pool import get_default_pool
+from metrics import STAGE_SECONDS, span, timed
+from response_cache import AsyncResponseCache, normalize_query
+from semantic_cache import SemanticCache
+from session_store import LRUSessionStore, Role
+from upstream import CircuitBreaker, ResilientClient, UpstreamUnavailable
+
+RECOMMENDATION_ERROR = "Error in generating recommendations."
+# 上游熔断期间的降级回复
+DEGRADED_REPLY = "哼…我现在有点累了，魔力不太够用。等一会儿再来找我吧，别误会了，才不是不想理你！(｀・ω・´)"
 
 class HKBU_ChatGPT:
-    def __init__(self, base_url=None, model=None, api_version=None, access_token=None, config_path='config.ini', firestore_db=None):
+    def __init__(self, base_url=None, model=None, api_version=None, access_token=None, config_path='config.ini', firestore_db=None, http_pool=None, event_index=None, session_store=None,
+                 context_builder=None, semantic_cache=None):
         self.config = configparser.ConfigParser()
         self.config.read(config_path)
 
@@ -25,10 +41,106 @@ class HKBU_ChatGPT:
             "不要太客气，也不要太机械。尽可能展现出你的个性和情绪。"
         )
 
-        self.memory = defaultdict(lambda: deque(maxlen=5))
+        self.memory = session_store or LRUSessionStore.from_env()
+        self.context_builder = context_builder or ContextBuilder.from_env()
+        self._summarizing = set()
+        # 语义缓存默认关闭，SEMANTIC_CACHE=1 开启
+        self.semantic_cache = semantic_cache
+        if self.semantic_cache is None and os.getenv("SEMANTIC_CACHE", "0") == "1":
+            self.semantic_cache = SemanticCache(
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+                capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", "512")),
+                ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+            )
+        self.semantic_cache_max_history = int(os.getenv("SEMANTIC_CACHE_MAX_HISTORY", "2"))
         self.firestore_db = firestore_db
+        self.writer = FirestoreWriteBehind(firestore_db) if firestore_db else None
+        self.http_pool = http_pool or get_default_pool()
+        self.upstream = ResilientClient(
+            self.http_pool,
+            connect_timeout=float(os.getenv("CHATGPT_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("CHATGPT_READ_TIMEOUT", "60")),
+            max_retries=int(os.getenv("CHATGPT_MAX_RETRIES", "2")),
+            hedge=os.getenv("CHATGPT_HEDGE", "0") == "1",
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("CHATGPT_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("CHATGPT_BREAKER_RESET", "30")),
+            ),
+        )
+        self.vvquest_url = os.getenv("VVQUEST_URL", "https://api.zvv.quest")
+        self.followup_timeout = float(os.getenv("CHATGPT_FOLLOWUP_TIMEOUT", "4.0"))
+        # 是否附带表情包的随机数；压测时设置 CHATGPT_RANDOM_SEED，同一个 seed 的结果可重复
+        seed = os.getenv("CHATGPT_RANDOM_SEED")
+        self._rng = random.Random(int(seed) if seed else None)
+        self._background_tasks = set()
+        self.event_index = event_index
+        # 活动索引只在 warm_up 里建立一次；锁保证并发的预热线程不会各挂一个监听
+        self._event_index_lock = threading.Lock()
+        self.event_search_limit = 5
+        # chat_history/{user_id} 文档里保存最近 history_tail_size 条消息，冷启动时一次点读即可恢复会话
+        self.history_tail_size = int(os.getenv("CHATGPT_HISTORY_TAIL", str(self.memory.max_messages)))
+        # user_id -> 本进程确认过的 message_count；只有确认过的用户才重写尾部文档，见 _persist_turn
+        self._tail_versions = OrderedDict()
+        self._tail_lock = threading.Lock()
+        self.prefetch_users = int(os.getenv("CHATGPT_PREFETCH_USERS", "500"))
+        self.prefetch_max_age = float(os.getenv("CHATGPT_PREFETCH_MAX_AGE", "86400"))
+        # 预加载结束（成功或失败）后置位；失败只意味着这些用户的第一条消息要查 Firestore，不影响就绪
+        self.sessions_prefetched = threading.Event()
+        if not firestore_db:
+            self.sessions_prefetched.set()
+        self.sticker_cache = AsyncResponseCache(
+            "vvquest",
+            maxsize=int(os.getenv("STICKER_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("STICKER_CACHE_TTL", "3600")),
+            negative_ttl=float(os.getenv("STICKER_CACHE_NEGATIVE_TTL", "300")),
+            # 请求失败（None）不缓存，只有 VVQuest 确实没有结果时才负缓存
+            should_cache=lambda value: value is not None,
+        )
+        self.recommendation_cache = AsyncResponseCache(
+            "recommendations",
+            maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "1800")),
+            should_cache=lambda value: value != [RECOMMENDATION_ERROR],
+        )
+
+    def _tail_ref(self, user_id):
+        return self.firestore_db.collection("chat_history").document(str(user_id))
+
+    @staticmethod
+    def _tail_is_current(data):
+        """
+        尾部文档里 message_count 由每轮对话原子递增，tail_count 是写入 tail 的进程当时所知的消息数。
+        两者相等说明 tail 包含了全部消息；其他实例（或本地会话过期的进程）写过之后两者不再相等，
+        tail 不可信，要回退到 messages 子集合。
+        """
+        return data.get("tail") is not None and data.get("message_count") is not None \
+            and data.get("tail_count") == data.get("message_count")
+
+    def _set_tail_version(self, user_id, version):
+        with self._tail_lock:
+            if version is None:
+                self._tail_versions.pop(user_id, None)
+                return
+            self._tail_versions[user_id] = version
+            self._tail_versions.move_to_end(user_id)
+            while len(self._tail_versions) > self.memory.max_users:
+                self._tail_versions.popitem(last=False)
 
     def load_history_from_firestore(self, user_id, limit=5):
+        """
+        优先读取尾部文档（一次点读）；没有尾部文档的老用户、或尾部文档落后于 messages 子集合时，
+        回退到查询 messages 子集合，下一轮对话写入时会重写尾部文档。
+        """
+        from google.cloud import firestore  # 延迟导入：grpc 等依赖很重，不拖慢冷启动
+
+        tail_doc = self._tail_ref(user_id).get().to_dict() or {}
+        if self._tail_is_current(tail_doc):
+            self._set_tail_version(user_id, tail_doc["message_count"])
+            return [
+                {"role": msg.get("role", "user"), "content": msg.get("content", "")}
+                for msg in tail_doc["tail"][-limit:]
+            ]
+
         context_ref = self.firestore_db.collection("chat_history").document(str(user_id)).collection("messages")
         query = context_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit)
         docs = query.stream()
@@ -40,6 +152,8 @@ class HKBU_ChatGPT:
                 "role": data.get("role", "user"),
                 "content": data.get("content", "")
             })
+        # 查询前读到的计数；查询期间如有其他写入，下次写入时计数对不上，尾部文档会再次被判为过期
+        self._set_tail_version(user_id, tail_doc.get("message_count") or 0)
         return history
 
     def save_message_to_firestore(self, user_id, role, content):
@@ -47,6 +161,8 @@ class HKBU_ChatGPT:
             print("❗ Firestore 数据库未初始化，跳过写入。")
             return
 
+        from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+
         try:
             msg_ref = self.firestore_db.collection("chat_history").document(str(user_id)).collection("messages").document()
             msg_ref.set({
@@ -70,35 +186,49 @@ class HKBU_ChatGPT:
         try:
             event_ref = self.firestore_db.collection("events").document()
             event_ref.set(event_data)
+            if self.event_index is not None:
+                self.event_index.upsert(event_ref.id, event_data)
             print("✅ 活动数据写入成功！")
         except Exception as e:
             print(f"❌ 活动数据写入失败: {e}")
 
-    def try_fetch_vvquest_image(self, query, n=1):
+    async def try_fetch_vvquest_image(self, query, n=1):
+        """按规范化后的消息缓存 VVQuest 结果，空结果短时间负缓存；请求失败时返回空列表，不缓存"""
+        images = await self.sticker_cache.get_or_load(
+            (normalize_query(query), n),
+            lambda: self._fetch_vvquest_image(query, n),
+        )
+        return images or []
+
+    @timed("sticker")
+    async def _fetch_vvquest_image(self, query, n=1):
+        """返回图片 URL 列表（没有结果时为空列表）；网络错误或接口报错返回 None"""
         try:
-            resp = requests.get("https://api.zvv.quest/search", params={"q": query, "n": n})
+            resp = await self.http_pool.get(f"{self.vvquest_url}/search", params={"q": query, "n": n})
             if resp.status_code == 200:
                 json_data = resp.json()
-                if json_data.get("code") == 200 and json_data.get("data"):
-                    return json_data["data"]
+                if json_data.get("code") == 200:
+                    return json_data.get("data") or []
+            print(f"⚠️ VVQuest API Error: status {resp.status_code}")
         except Exception as e:
             print(f"⚠️ VVQuest API Error: {e}")
-        return []
+        return None
 
-    def generate_dynamic_recommendations(self, message):
+    @timed("recommendations")
+    async def generate_dynamic_recommendations(self, message):
         """
         基于用户输入的消息生成动态的推荐内容。
         例如，通过 ChatGPT 识别意图，结合上下文智能推荐。
         """
         recommendations = []
 
-        # 先从 Firestore 中获取活动信息
+        # 先从本地活动索引中检索；索引还没有初始快照时直接用 ChatGPT 生成推荐，不等待
         events = self.fetch_events_from_firestore(message)
 
         # 如果没有找到合适的活动，再调用 ChatGPT 来生成推荐内容
         if not events:
             prompt = f"从以下对话内容中提取出用户的兴趣爱好并生成推荐活动或资源：\n'{message}'"
-            recommendations = self.ask_chatgpt_for_recommendations(prompt)
+            recommendations = await self.ask_chatgpt_for_recommendations(prompt)
         else:
             recommendations = events
 
@@ -106,28 +236,39 @@ class HKBU_ChatGPT:
 
     def fetch_events_from_firestore(self, message):
         """
-        从 Firestore 中检索与用户消息相关的活动，使用模糊搜索。
+        从本地活动关键词索引中检索与用户消息相关的活动，按匹配得分排序。
+        索引在 warm_up 时建立，之后由 Firestore 监听增量更新，查询不再读取 Firestore；
+        索引尚未建立或初始快照还没到时返回空列表，不阻塞消息处理。
         """
-        events_ref = self.firestore_db.collection("events")
-        query = events_ref.stream()
-
-        events = []
-        for doc in query:
-            event = doc.to_dict()
-            event_keywords = event.get("keywords", [])
-
-            # 使用正则表达式进行模糊匹配
-            for keyword in event_keywords:
-                if re.search(message, keyword, re.IGNORECASE):  # 匹配时忽略大小写
-                    events.append(event)
-                    break  # 找到匹配项后跳出内层循环
-
-        return events
-
-    def ask_chatgpt_for_recommendations(self, prompt):
+        index = self.event_index
+        if index is None or not index.ready.is_set():
+            return []
+        return index.search(message, limit=self.event_search_limit)
+
+    def _ensure_event_index(self):
+        """建立活动索引并挂上 Firestore 监听；重复或并发调用只会建立一次"""
+        with self._event_index_lock:
+            if self.event_index is None:
+                index = EventKeywordIndex()
+                index.attach(self.firestore_db.collection("events"))
+                self.event_index = index
+        return self.event_index
+
+    def _warm_event_index(self, timeout=10.0):
+        """预热时建立索引并等待初始快照（只在启动时等待，/ready 之后会实时反映索引状态）"""
+        return self._ensure_event_index().ready.wait(timeout=timeout)
+
+    async def ask_chatgpt_for_recommendations(self, prompt):
         """
         询问 ChatGPT 生成推荐活动或资源。
+        相同（规范化后）的提示词直接复用缓存的结果，失败的结果不缓存。
         """
+        return await self.recommendation_cache.get_or_load(
+            normalize_query(prompt),
+            lambda: self._ask_chatgpt_for_recommendations(prompt),
+        )
+
+    async def _ask_chatgpt_for_recommendations(self, prompt):
         url = f"{self.base_url}/deployments/{self.model}/completions/?api-version={self.api_version}"
         headers = {
             "Content-Type": "application/json",
@@ -140,79 +281,335 @@ class HKBU_ChatGPT:
         }
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = await self.upstream.post(url, json=payload, headers=headers)
             if response.status_code == 200:
                 return response.json().get('choices', [{}])[0].get('text', "").split("\n")
             else:
-                return ["Error in generating recommendations."]
+                return [RECOMMENDATION_ERROR]
         except Exception as e:
             print(f"⚠️ Error in generating recommendations: {e}")
-            return ["Error in generating recommendations."]
+            return [RECOMMENDATION_ERROR]
+
+    def _chat_request(self):
+        url = f"{self.base_url}/deployments/{self.model}/chat/completions/?api-version={self.api_version}"
+        headers = {
+            "Content-Type": "application/json",
+            "api-key": self.access_token
+        }
+        return url, headers
 
-    def submit(self, message, user_id=None):
+    def _semantic_lookup(self, message, user_id):
+        """
+        语义缓存只用于首轮或上下文很少的消息（回答基本不依赖历史）。
+        返回 (cacheable, cached_answer)：只有没有任何历史时生成的回答才能写入缓存，
+        否则回答可能依赖这个用户之前说过的话（例如名字），不能给别的用户复用。
+        """
+        if self.semantic_cache is None:
+            return False, None
+        window = self.memory.window(user_id)
+        if len(window.items) > self.semantic_cache_max_history:
+            return False, None
+        cacheable = not window.items and window.summary is None
+        cached = self.semantic_cache.lookup(message)
+        return cacheable, cached[0] if cached is not None else None
+
+    def _prepare_messages(self, message, user_id):
+        # 按 token 预算装入历史，超出预算的旧消息交给后台摘要
+        window = self.memory.window(user_id)
+        messages, dropped = self.context_builder.build(self.system_prompt, message, window)
+        pending, covered_seq = self.context_builder.pending_summary(window, dropped)
+        if pending and user_id not in self._summarizing:
+            self._spawn(self._refresh_summary(user_id, window.summary, pending, covered_seq))
+        return messages
+
+    def _finish_turn(self, user_id, message, content):
+        """记录本轮对话并启动后续任务，返回最终的回复 dict"""
+        self.memory.append(user_id, Role.USER, message)
+        self.memory.append(user_id, Role.ASSISTANT, content)
+        if self.memory.shared is not None:
+            self._spawn(self.memory.publish(user_id))
+
+        # 持久化放到后台，不占用回复路径
+        if self.firestore_db:
+            self._persist_turn(user_id, message, content)
+
+        # 表情包与推荐并发获取，调用方先发文本，再等待 followups 发送后续消息
+        followups = self._spawn(self.collect_followups(message))
+        return {"text": content, "followups": followups}
+
+    async def submit(self, message, user_id=None):
         try:
-            url = f"{self.base_url}/deployments/{self.model}/chat/completions/?api-version={self.api_version}"
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": self.access_token
-            }
+            url, headers = self._chat_request()
 
             if not user_id:
                 user_id = "anonymous"
 
-            if user_id not in self.memory:
-                self.memory[user_id] = deque(maxlen=5)
-                try:
-                    past = self.load_history_from_firestore(user_id, limit=5)
-                    for msg in past:
-                        self.memory[user_id].append(msg)
-                except Exception as e:
-                    print(f"⚠️ Firestore 加载失败: {e}")
+            with span("history_load"):
+                await self._load_history(user_id)
+            cacheable, cached = self._semantic_lookup(message, user_id)
+            if cached is not None:
+                return self._finish_turn(user_id, message, cached)
 
-            messages = [{"role": "system", "content": self.system_prompt}]
-            messages.extend(self.memory[user_id])
-            messages.append({"role": "user", "content": message})
+            messages = self._prepare_messages(message, user_id)
 
             payload = {"messages": messages}
-            response = requests.post(url, json=payload, headers=headers)
+            with span("completion"):
+                response = await self.upstream.post(url, json=payload, headers=headers)
 
             if response.status_code == 200:
                 content = response.json().get('choices', [{}])[0].get('message', {}).get('content', "No response")
+                if cacheable:
+                    self.semantic_cache.store(message, content)
+                return self._finish_turn(user_id, message, content)
 
-                self.memory[user_id].append({"role": "user", "content": message})
-                self.memory[user_id].append({"role": "assistant", "content": content})
-
-                if self.firestore_db:
-                    self.save_message_to_firestore(user_id, "user", message)
-                    self.save_message_to_firestore(user_id, "assistant", content)
-
-                # 60% 概率加入表情包图
-                if random.random() < 0.6:
-                    images = self.try_fetch_vvquest_image(query=message, n=1)
-                    if images:
-                        return {"text": content, "image_url": images[0]}
-
-                # 动态推荐内容
-                dynamic_recommendations = self.generate_dynamic_recommendations(message)
+            else:
+                return {"text": f"Error: API request failed (Status Code: {response.status_code})"}
 
-                return {"text": content, "recommendations": dynamic_recommendations}
+        except UpstreamUnavailable:
+            return {"text": DEGRADED_REPLY}
+        except Exception as e:
+            return {"text": f"Error: {str(e)}"}
 
-                # 输出完整对话日志
-                self.print_conversation_log(user_id)
+    async def submit_stream(self, message, user_id=None):
+        """
+        submit 的流式版本（异步生成器）。
+        生成过程中逐段产出 {"delta": "..."}，结束时产出一次与 submit 相同格式的最终回复 dict。
+        """
+        if not user_id:
+            user_id = "anonymous"
 
-                return {"text": content}
+        try:
+            url, headers = self._chat_request()
+            with span("history_load"):
+                await self._load_history(user_id)
+            cacheable, cached = self._semantic_lookup(message, user_id)
+            if cached is not None:
+                yield {"delta": cached}
+                yield self._finish_turn(user_id, message, cached)
+                return
+
+            messages = self._prepare_messages(message, user_id)
+            payload = {"messages": messages, "stream": True}
+
+            parts = []
+            started = time.perf_counter()
+            async with self.upstream.stream("POST", url, json=payload, headers=headers) as response:
+                if response.status_code != 200:
+                    yield {"text": f"Error: API request failed (Status Code: {response.status_code})"}
+                    return
+                async for line in response.aiter_lines():
+                    # SSE 格式：每行 "data: {...}"，以 "data: [DONE]" 结束
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        if not parts:
+                            STAGE_SECONDS.observe(time.perf_counter() - started, stage="first_token")
+                        parts.append(delta)
+                        yield {"delta": delta}
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="completion_stream")
+
+            content = "".join(parts) or "No response"
+            if cacheable and parts:
+                self.semantic_cache.store(message, content)
+            yield self._finish_turn(user_id, message, content)
+
+        except UpstreamUnavailable:
+            yield {"text": DEGRADED_REPLY}
+        except Exception as e:
+            yield {"text": f"Error: {str(e)}"}
+
+    async def _load_history(self, user_id):
+        """依次从本地会话缓存、共享后端、Firestore 取最近的对话（多工作进程时先读共享后端）"""
+        if self.memory.prefer_shared:
+            history = await self.memory.fetch_shared(user_id)
+            if history is not None:
+                return history
+        history = self.memory.get(user_id)
+        if history is not None:
+            return history
+        if not self.memory.prefer_shared:
+            history = await self.memory.fetch_shared(user_id)
+            if history is not None:
+                return history
 
-            else:
-                return {"text": f"Error: API request failed (Status Code: {response.status_code})"}
+        history = []
+        if self.firestore_db:
+            try:
+                history = await asyncio.to_thread(self.load_history_from_firestore, user_id, limit=self.memory.max_messages)
+            except Exception as e:
+                print(f"⚠️ Firestore 加载失败: {e}")
+                # 本地会话不完整，不能用它重写尾部文档
+                self._set_tail_version(user_id, None)
+        self.memory.put(user_id, history)
+        return history
 
+    async def _refresh_summary(self, user_id, summary, pending, covered_seq):
+        """把滚动摘要和新丢弃的旧消息压缩成一条新摘要，缓存到会话里"""
+        self._summarizing.add(user_id)
+        try:
+            transcript = "\n".join(f"{role.name.lower()}: {content}" for role, content, _ in pending)
+            if summary:
+                transcript = f"已有摘要：{summary[1]}\n{transcript}"
+            url, headers = self._chat_request()
+            payload = {"messages": [
+                {"role": "system", "content": "请用不超过 100 字概括以下对话的要点，保留用户的重要信息和偏好。"},
+                {"role": "user", "content": transcript},
+            ]}
+            response = await self.upstream.post(url, json=payload, headers=headers)
+            if response.status_code == 200:
+                text = response.json().get('choices', [{}])[0].get('message', {}).get('content', "")
+                if text:
+                    self.memory.set_summary(user_id, covered_seq, text)
         except Exception as e:
-            return {"text": f"Error: {str(e)}"}
+            print(f"⚠️ 对话摘要生成失败: {e}")
+        finally:
+            self._summarizing.discard(user_id)
+
+    def _spawn(self, coro):
+        """启动后台任务并保留引用，避免任务在完成前被垃圾回收"""
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def _persist_turn(self, user_id, message, content):
+        """把一轮对话放进写后队列，由后台批量提交到 Firestore"""
+        from google.cloud import firestore
+        messages_ref = self.firestore_db.collection("chat_history").document(str(user_id)).collection("messages")
+        # 同一 batch 内 SERVER_TIMESTAMP 相同，改用客户端时间保证 user 在 assistant 之前
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.writer.enqueue(messages_ref.document(), {"role": "user", "content": message, "timestamp": now})
+        self.writer.enqueue(messages_ref.document(), {
+            "role": "assistant",
+            "content": content,
+            "timestamp": now + datetime.timedelta(microseconds=1),
+        })
+        # 尾部文档与 messages 子集合一起提交。message_count 总是原子递增；
+        # 只有本进程确认过计数的用户才用本地会话（本轮已追加）重写 tail，否则 tail 留给下次加载时判为过期
+        update = {
+            "user_id": user_id,
+            "updated_at": now + datetime.timedelta(microseconds=1),
+            "message_count": firestore.Increment(2),
+        }
+        with self._tail_lock:
+            version = self._tail_versions.get(user_id)
+            if version is not None:
+                self._tail_versions[user_id] = version + 2
+        if version is not None:
+            window = self.memory.window(user_id)
+            update["tail"] = [
+                {"role": role.name.lower(), "content": text} for role, text, _ in window.items[-self.history_tail_size:]
+            ]
+            update["tail_count"] = version + 2
+        self.writer.enqueue(self._tail_ref(user_id), update, merge=True)
+
+    def prefetch_recent_sessions(self):
+        """
+        启动时按 updated_at 倒序读取最近活跃用户的尾部文档（一次查询），直接写入本地会话缓存，
+        新实例处理这些用户的第一条消息时不用再查 Firestore。返回载入的用户数。
+        """
+        try:
+            return self._prefetch_recent_sessions()
+        finally:
+            self.sessions_prefetched.set()
+
+    def _prefetch_recent_sessions(self):
+        from google.cloud import firestore
+
+        if not self.firestore_db or self.prefetch_users <= 0:
+            return 0
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.prefetch_max_age)
+        query = (
+            self.firestore_db.collection("chat_history")
+            .order_by("updated_at", direction=firestore.Query.DESCENDING)
+            .limit(self.prefetch_users)
+        )
+        loaded = 0
+        for doc in query.stream():
+            data = doc.to_dict() or {}
+            updated_at = data.get("updated_at")
+            if updated_at is not None and updated_at < cutoff:
+                break
+            user_id = data.get("user_id", doc.id)
+            if not self._tail_is_current(data) or user_id in self.memory:
+                continue
+            self.memory.put(user_id, data["tail"][-self.memory.max_messages:])
+            self._set_tail_version(user_id, data["message_count"])
+            loaded += 1
+        print(f"✅ 预加载了 {loaded} 个最近活跃用户的会话")
+        return loaded
+
+    async def _maybe_fetch_sticker(self, message):
+        # 60% 概率加入表情包图
+        if self._rng.random() < 0.6:
+            images = await self.try_fetch_vvquest_image(query=message, n=1)
+            if images:
+                return images[0]
+        return None
+
+    async def collect_followups(self, message):
+        """
+        并发获取表情包和动态推荐，超过 followup_timeout 仍未完成的部分直接丢弃。
+        返回 {"image_url": ..., "recommendations": [...]}，只包含按时拿到的结果。
+        """
+        tasks = {
+            "image_url": asyncio.ensure_future(self._maybe_fetch_sticker(message)),
+            "recommendations": asyncio.ensure_future(self.generate_dynamic_recommendations(message)),
+        }
+        done, pending = await asyncio.wait(tasks.values(), timeout=self.followup_timeout)
+        for task in pending:
+            task.cancel()
+
+        followups = {}
+        for key, task in tasks.items():
+            if task not in done or task.exception() is not None:
+                continue
+            result = task.result()
+            if key == "recommendations":
+                result = [r for r in result if r and r != RECOMMENDATION_ERROR]
+            if result:
+                followups[key] = result
+        return followups
 
     def print_conversation_log(self, user_id):
         """输出完整对话日志"""
-        if user_id in self.memory:
+        history = self.memory.get(user_id)
+        if history is not None:
             print(f"User {user_id} 对话日志:")
-            for msg in self.memory[user_id]:
+            for msg in history:
                 print(f"{msg['role'].capitalize()}: {msg['content']}")
         else:
             print(f"User {user_id} 暂无对话记录。")
+
+    async def warm_up(self):
+        """
+        启动时预热：并发建立到 HKBU / VVQuest 的连接，加载活动索引的初始快照并预加载最近活跃用户的会话，
+        让第一条消息不用承担建连、建索引和查询历史的耗时。返回各项是否成功。
+        """
+        tasks = {
+            "hkbu": self.http_pool.warm(self.base_url),
+            "vvquest": self.http_pool.warm(self.vvquest_url),
+        }
+        if self.firestore_db is not None:
+            tasks["event_index"] = asyncio.to_thread(self._warm_event_index)
+            tasks["sessions"] = asyncio.to_thread(self.prefetch_recent_sessions)
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for name, result in zip(tasks, results):
+            if isinstance(result, BaseException):
+                print(f"⚠️ 预热 {name} 失败: {result}")
+        return {name: result is not False and not isinstance(result, BaseException) for name, result in zip(tasks, results)}
+
+    async def aclose(self):
+        """等待后台任务结束、刷完写入队列，停止活动索引监听并关闭共享的 HTTP 连接池"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        if self.writer is not None:
+            await self.writer.aclose()
+        if self.event_index is not None:
+            self.event_index.close()
+        await self.http_pool.aclose()
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+RATE_LIMITED = "rate_limited"
+OVERLOADED = "overloaded"
+
+
+class AdmissionRejected(Exception):
+    """请求未被放行；reason 为 RATE_LIMITED 或 OVERLOADED"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def try_take(self, now, amount=1.0) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+
+class AdmissionController:
+    """
+    LLM 调用的准入控制：
+    - 每个用户一个令牌桶（per_user_rate 次/秒，最多攒 per_user_burst 次），防止单个用户刷屏耗尽配额
+    - 全局信号量限制同时进行的上游调用数，排队超过 max_wait 秒直接拒绝，不让请求一直挂着
+    多工作进程部署时传入 shared_limiter（如 shared_state.RedisRateLimiter），令牌桶在进程间共享；
+    共享后端出错时退回进程内的令牌桶。并发上限始终按进程计算。
+    """
+
+    def __init__(self, per_user_rate=0.2, per_user_burst=3, max_concurrent=8, max_wait=5.0,
+                 max_users=10000, shared_limiter=None, clock=time.monotonic):
+        self.per_user_rate = per_user_rate
+        self.per_user_burst = per_user_burst
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self.shared_limiter = shared_limiter
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._semaphore = None
+        self._in_flight = 0
+        self._waiting = 0
+
+        self.admitted = 0
+        self.rate_limited = 0
+        self.overloaded = 0
+        self.shared_errors = 0
+
+    def _bucket(self, user_id, now):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_user_rate, self.per_user_burst, now)
+            self._buckets[user_id] = bucket
+            # 只保留最近活跃的用户；被淘汰的用户下次回来时令牌桶是满的
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    async def _try_take(self, user_id):
+        if self.shared_limiter is not None:
+            try:
+                return await self.shared_limiter.try_take(user_id, self.per_user_rate, self.per_user_burst)
+            except Exception:
+                self.shared_errors += 1
+        now = self._clock()
+        return self._bucket(user_id, now).try_take(now)
+
+    @asynccontextmanager
+    async def admit(self, user_id):
+        if not await self._try_take(user_id):
+            self.rate_limited += 1
+            raise AdmissionRejected(RATE_LIMITED)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.overloaded += 1
+            raise AdmissionRejected(OVERLOADED)
+        finally:
+            self._waiting -= 1
+
+        self.admitted += 1
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "overloaded": self.overloaded,
+            "shared_errors": self.shared_errors,
+        }
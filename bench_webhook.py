@@ -0,0 +1,427 @@
+"""
+Webhook 压测脚本：用本地桩服务代替 HKBU / VVQuest / 舞萌 API / Telegram，内存版 Firestore 代替数据库，
+按设定速率向 Quart 的 /webhook 发送合成的 Telegram Update，统计吞吐、延迟分位数和各阶段耗时。
+
+    python bench_webhook.py --rate 20 --duration 30 --users 50
+    python bench_webhook.py --save-baseline main          # 记录基线到 bench_baselines.json
+    python bench_webhook.py --compare main --tolerance 0.15  # 与基线比较，退化时返回非 0
+
+同样的 --seed 会产生同样的请求序列（用户、消息内容、到达时间），桩服务的延迟和错误注入也由它派生的种子抽样。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+from stub_server import StubMaimai, StubTelegram, StubUpstream, StubVVQuest
+
+SAMPLE_MESSAGES = [
+    "你是谁？",
+    "今天有什么好玩的活动吗",
+    "推荐一下周末的音乐会",
+    "我有点无聊，陪我聊聊天",
+    "你觉得桌游之夜怎么样",
+    "最近在玩舞萌，有什么建议",
+    "明天要考试了好紧张",
+    "给我讲个笑话吧",
+]
+
+SEED_EVENTS = [
+    {"title": "周末音乐会", "keywords": ["音乐会", "音乐", "周末"]},
+    {"title": "桌游之夜", "keywords": ["桌游", "游戏", "聚会"]},
+    {"title": "读书分享会", "keywords": ["读书", "分享"]},
+    {"title": "舞萌交流赛", "keywords": ["舞萌", "音游", "比赛"]},
+]
+
+# 压测结果里参与基线比较的指标：(键, 越大越好)
+COMPARED_METRICS = [
+    ("throughput", True),
+    ("startup_seconds", False),
+    ("ack_p95", False),
+    ("reply_p50", False),
+    ("reply_p95", False),
+    ("reply_p99", False),
+]
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def reply_kind(text):
+    """根据回复内容判断它回应的是哪类消息，用来把回复和请求对应起来（准入拒绝的提示另见 ReplyTracker）"""
+    if text.startswith("Available commands"):
+        return "help"
+    if text.startswith("You have said") or text.startswith("Usage: /add"):
+        return "add"
+    return "chat"
+
+
+class ReplyTracker:
+    """
+    记录每个聊天里等待回复的请求（按消息类型分别排队），Telegram 桩收到 sendMessage 时
+    取出最早的一条计算“首条回复”延迟。表情包、推荐和流式编辑都不算首条回复。
+    被准入控制拒绝的对话收到的是固定提示，不调用 LLM，单独计入 rejected，不拉低对话的回复延迟。
+    """
+
+    def __init__(self):
+        self._pending = defaultdict(deque)   # (chat_id, kind) -> deque[sent_at]
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)   # kind -> [seconds]
+        self.rejected = []                   # 准入拒绝提示的延迟
+        self.rejection_texts = set()         # 导入 chatbot_quart 后填入 ADMISSION_REPLIES
+        self.unmatched = 0
+
+    def expect(self, chat_id, kind, sent_at):
+        with self._lock:
+            self._pending[(chat_id, kind)].append(sent_at)
+
+    def cancel(self, chat_id, kind, sent_at):
+        with self._lock:
+            try:
+                self._pending[(chat_id, kind)].remove(sent_at)
+            except ValueError:
+                pass
+
+    def on_send(self, chat_id, method, text):
+        if method != "sendMessage" or text.startswith("📌"):
+            return
+        now = time.perf_counter()
+        rejected = text in self.rejection_texts
+        kind = "chat" if rejected else reply_kind(text)
+        with self._lock:
+            pending = self._pending.get((chat_id, kind))
+            if not pending:
+                self.unmatched += 1
+                return
+            latency = now - pending.popleft()
+            if rejected:
+                self.rejected.append(latency)
+            else:
+                self.latencies[kind].append(latency)
+
+    @property
+    def outstanding(self):
+        with self._lock:
+            return sum(len(q) for q in self._pending.values())
+
+
+def build_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def generate_schedule(args):
+    """预先生成 (到达时间, 类型, user_id, 文本) 序列，保证同一个 seed 的压测可重复"""
+    rng = random.Random(args.seed)
+    kinds, weights = zip(*(("chat", args.chat_ratio), ("help", args.help_ratio), ("add", args.add_ratio)))
+    schedule = []
+    at = 0.0
+    while True:
+        at += rng.expovariate(args.rate)
+        if at >= args.duration:
+            return schedule
+        kind = rng.choices(kinds, weights)[0]
+        user_id = 100000 + rng.randrange(args.users)
+        if kind == "help":
+            text = "/help"
+        elif kind == "add":
+            text = f"/add {rng.choice(['舞萌', '桌游', '音乐会'])}"
+        else:
+            text = rng.choice(SAMPLE_MESSAGES)
+        schedule.append((at, kind, user_id, text))
+
+
+def stage_breakdown(before, after, buckets):
+    from metrics import bucket_quantile
+
+    stages = {}
+    for key, series in after.items():
+        previous = before.get(key, [0] * len(series))
+        delta = [a - b for a, b in zip(series, previous)]
+        count = delta[-1]
+        if not count:
+            continue
+        stages[key[0]] = {
+            "count": count,
+            "mean": delta[-2] / count,
+            "p50": bucket_quantile(buckets, delta, 0.50),
+            "p95": bucket_quantile(buckets, delta, 0.95),
+            "p99": bucket_quantile(buckets, delta, 0.99),
+        }
+    return stages
+
+
+def stub_seed(args, name):
+    """每个桩服务一个由 --seed 派生的独立种子"""
+    return f"{args.seed}:{name}"
+
+
+def configure_environment(args, upstream, vvquest, maimai, state_dir):
+    """
+    必须在导入 chatbot_quart 之前设置，部分配置在导入时读取。
+    file_id 缓存写到 state_dir 下的临时文件，每次压测都从空缓存开始，结果可重复
+    """
+    os.environ.update({
+        "MEDIA_CACHE_BACKEND": "sqlite",
+        "MEDIA_CACHE_PATH": os.path.join(state_dir, "media_cache.sqlite3"),
+        "CHATGPT_BASTCURL": upstream.base_url,
+        "CHATGPT_MODELNAME": "stub-model",
+        "CHATGPT_APIVERSION": "2024-01-01",
+        "CHATGPT_ACCESS_TOKEN": "stub",
+        "TELEGRAM_ACCESS_TOKEN": "123456:STUB",
+        "VVQUEST_URL": vvquest.base_url,
+        "MAIMAI_API_URL": maimai.base_url,
+        "CHATGPT_STREAMING": "1" if args.streaming else "0",
+        "CHATGPT_RANDOM_SEED": str(args.seed),
+    })
+
+
+async def run_load(args, tracker, telegram_stub):
+    import_started = time.perf_counter()
+    import chatbot_quart
+    import_seconds = time.perf_counter() - import_started
+    tracker.rejection_texts = set(chatbot_quart.ADMISSION_REPLIES.values())
+    from firestore_fake import FakeFirestore
+    from metrics import STAGE_SECONDS
+
+    db = FakeFirestore()
+    for event in SEED_EVENTS:
+        db.collection("events").document().set(event)
+    chatbot_quart.setup(db, telegram_base_url=f"{telegram_stub.base_url}/bot")
+
+    schedule = generate_schedule(args)
+    ack_latencies = []
+    statuses = defaultdict(int)
+    stages_before = STAGE_SECONDS.snapshot()
+
+    async with chatbot_quart.app.test_app() as test_app:
+        client = test_app.test_client()
+
+        # 冷启动：等待 /ready 变为 200 再开始施压
+        ready_deadline = time.perf_counter() + args.drain_timeout
+        while (await client.get("/ready")).status_code != 200 and time.perf_counter() < ready_deadline:
+            await asyncio.sleep(0.01)
+
+        async def send(update_id, kind, user_id, text):
+            sent_at = time.perf_counter()
+            tracker.expect(user_id, kind, sent_at)
+            response = await client.post("/webhook", json=build_update(update_id, user_id, text))
+            ack_latencies.append(time.perf_counter() - sent_at)
+            statuses[response.status_code] += 1
+            if response.status_code != 200:
+                tracker.cancel(user_id, kind, sent_at)
+
+        # 开环负载：按预定时间发出请求，不等待上一个请求完成
+        started = time.perf_counter()
+        tasks = []
+        for update_id, (at, kind, user_id, text) in enumerate(schedule, start=1):
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(update_id, kind, user_id, text)))
+        await asyncio.gather(*tasks)
+
+        # 等待还没回复的请求处理完
+        deadline = time.perf_counter() + args.drain_timeout
+        while tracker.outstanding and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        components = {
+            "webhook": chatbot_quart.update_dispatcher.stats(),
+            "admission": chatbot_quart.llm_admission.stats(),
+            "upstream": chatbot_quart.chatgpt.upstream.stats(),
+            "sticker_cache": chatbot_quart.chatgpt.sticker_cache.stats(),
+            "recommendation_cache": chatbot_quart.chatgpt.recommendation_cache.stats(),
+        }
+    # 退出 test_app 时会执行 after_serving，写入队列在这里刷完
+    components["firestore"] = {"rpc_count": db.rpc_count, "batch_commits": db.batch_commits}
+
+    all_replies = [s for samples in tracker.latencies.values() for s in samples]
+    return {
+        "requests": len(schedule),
+        "replied": len(all_replies),
+        "timed_out": tracker.outstanding,
+        "unmatched_replies": tracker.unmatched,
+        "rejected_replies": len(tracker.rejected),
+        "rejected_p50": percentile(tracker.rejected, 0.50),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "elapsed": elapsed,
+        "throughput": len(all_replies) / elapsed if elapsed else 0.0,
+        "import_seconds": import_seconds,
+        "startup_seconds": chatbot_quart.STARTUP.ready_seconds,
+        "ack_p50": percentile(ack_latencies, 0.50),
+        "ack_p95": percentile(ack_latencies, 0.95),
+        "ack_p99": percentile(ack_latencies, 0.99),
+        "reply_p50": percentile(all_replies, 0.50),
+        "reply_p95": percentile(all_replies, 0.95),
+        "reply_p99": percentile(all_replies, 0.99),
+        "reply_by_kind": {
+            kind: {
+                "count": len(samples),
+                "p50": percentile(samples, 0.50),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+            }
+            for kind, samples in sorted(tracker.latencies.items())
+        },
+        "stages": stage_breakdown(stages_before, STAGE_SECONDS.snapshot(), STAGE_SECONDS.buckets),
+        "components": components,
+    }
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+def print_report(result):
+    print(f"\n📊 {result['requests']} requests, {result['replied']} replied, "
+          f"{result['timed_out']} timed out in {result['elapsed']:.1f}s "
+          f"({result['throughput']:.2f} replies/s), statuses {result['statuses']}")
+    print(f"  cold start   import={format_seconds(result['import_seconds'])} "
+          f"ready={format_seconds(result['startup_seconds'])}")
+    print(f"  webhook ack  p50={format_seconds(result['ack_p50'])} p95={format_seconds(result['ack_p95'])} "
+          f"p99={format_seconds(result['ack_p99'])}")
+    print(f"  first reply  p50={format_seconds(result['reply_p50'])} p95={format_seconds(result['reply_p95'])} "
+          f"p99={format_seconds(result['reply_p99'])}")
+    print(f"  rejected     n={result['rejected_replies']} p50={format_seconds(result['rejected_p50'])} "
+          f"(admission replies, excluded from first reply)")
+    for kind, row in result["reply_by_kind"].items():
+        print(f"    {kind:<6} n={row['count']:<5} p50={format_seconds(row['p50'])} "
+              f"p95={format_seconds(row['p95'])} p99={format_seconds(row['p99'])}")
+    print("  stages (estimated from histogram buckets):")
+    for stage, row in sorted(result["stages"].items()):
+        print(f"    {stage:<16} n={row['count']:<5} mean={format_seconds(row['mean'])} "
+              f"p50={format_seconds(row['p50'])} p95={format_seconds(row['p95'])} p99={format_seconds(row['p99'])}")
+    print("  components:")
+    for name, stats in result["components"].items():
+        print(f"    {name}: {json.dumps(stats, ensure_ascii=False)}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(result, baseline, tolerance):
+    """返回退化的指标列表；baseline 里缺失的指标跳过"""
+    regressions = []
+    for key, higher_is_better in COMPARED_METRICS:
+        old, new = baseline["result"].get(key), result.get(key)
+        if old is None or new is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        status = "❌" if worse > tolerance else "✅"
+        print(f"  {status} {key:<11} baseline={old:.4f} now={new:.4f} ({change:+.1%})")
+        if worse > tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Quart /webhook endpoint against local stubs.")
+    parser.add_argument("--rate", type=float, default=10.0, help="average updates per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--users", type=int, default=50, help="number of distinct synthetic users")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chat-ratio", type=float, default=0.8)
+    parser.add_argument("--help-ratio", type=float, default=0.1)
+    parser.add_argument("--add-ratio", type=float, default=0.1)
+    parser.add_argument("--streaming", action="store_true", help="reply by streaming message edits")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="median chat-completions latency (s)")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="lognormal sigma of the LLM latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--vvquest-latency", type=float, default=0.3)
+    parser.add_argument("--maimai-latency", type=float, default=0.2)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--baselines", default="bench_baselines.json", help="baseline file")
+    parser.add_argument("--save-baseline", metavar="NAME", help="store this run as baseline NAME")
+    parser.add_argument("--compare", metavar="NAME", help="compare with baseline NAME and fail on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--output", help="write the full result as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tracker = ReplyTracker()
+    upstream = StubUpstream(latency=args.llm_latency, sigma=args.llm_sigma, error_rate=args.llm_error_rate,
+                            seed=stub_seed(args, "upstream"))
+    vvquest = StubVVQuest(latency=args.vvquest_latency, sigma=0.3, seed=stub_seed(args, "vvquest"))
+    maimai = StubMaimai(latency=args.maimai_latency, seed=stub_seed(args, "maimai"))
+    telegram_stub = StubTelegram(on_send=tracker.on_send, latency=args.telegram_latency,
+                                 seed=stub_seed(args, "telegram"))
+
+    with upstream, vvquest, maimai, telegram_stub, tempfile.TemporaryDirectory() as state_dir:
+        configure_environment(args, upstream, vvquest, maimai, state_dir)
+        result = asyncio.run(run_load(args, tracker, telegram_stub))
+
+    result["config"] = {k: v for k, v in vars(args).items()
+                        if k not in ("baselines", "save_baseline", "compare", "tolerance", "output")}
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    exit_code = 0
+    baselines = load_baselines(args.baselines)
+    if args.compare:
+        baseline = baselines.get(args.compare)
+        if baseline is None:
+            print(f"⚠️ Baseline '{args.compare}' not found in {args.baselines}")
+            exit_code = 2
+        else:
+            if baseline.get("config") != result["config"]:
+                print("⚠️ Baseline was recorded with different settings, comparison may be meaningless")
+            print(f"\n🔍 Compared with baseline '{args.compare}' ({baseline.get('revision') or 'unknown revision'}):")
+            if compare(result, baseline, args.tolerance):
+                exit_code = 1
+
+    if args.save_baseline:
+        baselines[args.save_baseline] = {
+            "revision": git_revision(),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": result["config"],
+            "result": {key: result[key] for key, _ in COMPARED_METRICS},
+        }
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"💾 Baseline '{args.save_baseline}' saved to {args.baselines}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -13,6 +13,7 @@ from telegram.ext import (
     filters,
 )
 from ChatGPT_HKBU import HKBU_ChatGPT
+from sharded_counter import ShardedCounter
 
 # 配置日志
 logging.basicConfig(
@@ -24,6 +25,7 @@ logger = logging.getLogger(__name__)
 # 全局变量
 global db
 global chatgpt
+global keyword_counter
 
 # 获取配置函数：优先使用环境变量，其次读取 config.ini
 def get_config(section: str, key: str, fallback: str = None) -> str:
@@ -53,9 +55,7 @@ def get_config(section: str, key: str, fallback: str = None) -> str:
 async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         keyword = context.args[0]
-        doc_ref = db.collection("keyword_counts").document(keyword)
-        doc_ref.set({"count": firestore.Increment(1)}, merge=True)
-        count = doc_ref.get().to_dict().get("count", 1)
+        count = await keyword_counter.increment(keyword)
         await update.message.reply_text(f'You have said "{keyword}" for {count} times.')
     except (IndexError, ValueError):
         await update.message.reply_text("Usage: /add <keyword>")
@@ -84,13 +84,19 @@ async def hello_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def equiped_chatgpt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_message = update.message.text
-        reply_message = chatgpt.submit(user_message)
+        reply = await chatgpt.submit(user_message, user_id=update.effective_user.id)
+        reply_message = reply["text"] if isinstance(reply, dict) else str(reply)
         logger.info(f"User: {user_message}, ChatGPT: {reply_message}")
         await context.bot.send_message(chat_id=update.effective_chat.id, text=reply_message)
     except Exception as e:
         logger.error(f"Error in ChatGPT response: {str(e)}")
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, I'm having trouble responding right now.")
 
+# 退出前把本地累积的关键词计数写回 Firestore，并关闭 HTTP 连接池
+async def on_shutdown(application):
+    await keyword_counter.aclose()
+    await chatgpt.aclose()
+
 # 主入口
 def main():
 
@@ -105,8 +111,9 @@ def main():
             cred = credentials.Certificate(firebase_key_path)
 
         firebase_admin.initialize_app(cred)
-        global db
+        global db, keyword_counter
         db = firestore.client()
+        keyword_counter = ShardedCounter(db, num_shards=int(get_config("FIRESTORE", "KEYWORD_COUNTER_SHARDS", "10")))
         logger.info("✅ Connected to Firestore successfully!")
     except Exception as e:
         logger.error(f"❌ Failed to connect to Firestore: {str(e)}")
@@ -128,7 +135,7 @@ def main():
     )
 
     # 创建 Telegram 应用
-    application = ApplicationBuilder().token(telegram_token).build()
+    application = ApplicationBuilder().token(telegram_token).post_shutdown(on_shutdown).build()
 
     # 注册处理器
     application.add_handler(CommandHandler("add", add))
@@ -1,36 +1,61 @@
-import os
-import json
-import logging
-import configparser
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-from quart import Quart, request
-import asyncio
-
-from telegram import Update
-from telegram.ext import (
-    ApplicationBuilder,
-    CommandHandler,
-    MessageHandler,
-    ContextTypes,
-    filters,
-)
-
-from ChatGPT_HKBU import HKBU_ChatGPT
-import requests
-
-# 初始化 Quart 应用
-app = Quart(__name__)
+from startup_profile import STARTUP
+
+with STARTUP.imports():
+    import os
+    import json
+    import logging
+    import configparser
+
+    from quart import Blueprint, Quart, request
+    import asyncio
+
+    from telegram import Update
+    from telegram.ext import (
+        ApplicationBuilder,
+        CommandHandler,
+        MessageHandler,
+        ContextTypes,
+        filters,
+    )
+
+    from admission import OVERLOADED, RATE_LIMITED, AdmissionController, AdmissionRejected
+    from ChatGPT_HKBU import HKBU_ChatGPT
+    from maimai_client import MaimaiClient
+    from media_cache import MediaCacheWarmer, MediaFileCache
+    from metrics import REGISTRY, configure_logging, new_trace_id, span
+    from shared_state import RedisRateLimiter, RedisUpdateDedupe
+    from sharded_counter import ShardedCounter
+    from telegram_outbox import TelegramOutbox
+    from telegram_stream import StreamingMessageSender
+    from traffic_capture import TrafficRecorder
+    from update_queue import ACCEPTED, REJECTED, UpdateDispatcher
+    # firebase_admin / google-cloud-firestore / grpc 很重，第一个请求用不到，延迟到使用时再导入
+
+# 路由和生命周期钩子注册在蓝图上，由 create_app() 组装成 ASGI 应用。
+# 多工作进程部署时每个进程各自导入本模块，下面这些全局对象都是进程内的；
+# 需要跨进程一致的状态（会话、update 去重、用户限流）通过 Redis 共享，见 shared_state.py
+bot = Blueprint("bot", __name__)
 telegram_app = None  # 全局 Telegram 应用
 chatgpt = None
 db = None
+keyword_counter = None
+update_dispatcher = None
+llm_admission = None
+maimai_client = None
+outbox = None  # 所有外发消息都经过发送队列，遵守 Telegram 的限流规则
+media_cache = None  # 表情包图片 URL -> Telegram file_id
+media_warmer = None
+shared_dedupe = None  # 跨进程 update 去重（未配置 Redis 时为 None，只做进程内去重）
+traffic_recorder = None  # 设置 TRAFFIC_CAPTURE_PATH 时采集匿名化的流量，供 replay_traffic.py 离线重放
+readiness = {}  # 各组件是否已预热完成，由 /ready 报告
+startup_tasks = set()
+followup_tasks = set()  # 正在等待或发送表情包/推荐的后台任务
+# 就绪必需的组件；hkbu / vvquest 预连接只是尽力而为，失败不影响就绪
+READY_COMPONENTS = ("firestore", "telegram", "event_index", "sessions")
+STREAM_REPLIES = os.getenv("CHATGPT_STREAMING", "0") == "1"  # 是否以流式编辑消息的方式回复
 
-# 配置日志
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# 配置日志（LOG_FORMAT=json 输出结构化日志，均带 trace_id）
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # 配置读取函数
@@ -51,53 +76,51 @@ def get_config(section: str, key: str, fallback: str = None) -> str:
             return fallback
         raise ValueError(f"Missing config: {section}.{key}")
 
-# === 获取舞萌 DX 玩家资料 ===
-def get_maimai_player_profile(player_id: str) -> dict:
-    """ 调用舞萌 API 获取玩家资料 """
-    token = os.getenv("MAIMAI_PERSONAL_TOKEN")  # 从环境变量获取个人 Token
-    url = f"https://maimai.lxns.net/api/v0/user/maimai/player"
-    params = {
-        "X-User-Token": token,
-    }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return {"error": "无法获取玩家资料"}
+def format_recommendations(recommendations) -> str:
+    """ 把活动（dict）或 ChatGPT 生成的推荐（str）整理成一条消息 """
+    lines = []
+    for item in recommendations or []:
+        if isinstance(item, dict):
+            item = item.get("title") or item.get("name") or ""
+        item = str(item).strip()
+        if item:
+            lines.append(f"• {item}")
+    if not lines:
+        return ""
+    return "📌 推荐给你:\n" + "\n".join(lines)
 
 # === 命令处理器 ===
 async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         keyword = context.args[0]
-        doc_ref = db.collection("keyword_counts").document(keyword)
-        doc_ref.set({"count": firestore.Increment(1)}, merge=True)
-        count = doc_ref.get().to_dict().get("count", 1)
-        await update.message.reply_text(f'You have said "{keyword}" for {count} times.')
+        count = await keyword_counter.increment(keyword)
+        await outbox.send_message(update.effective_chat.id, f'You have said "{keyword}" for {count} times.')
     except (IndexError, ValueError):
-        await update.message.reply_text("Usage: /add <keyword>")
+        await outbox.send_message(update.effective_chat.id, "Usage: /add <keyword>")
     except Exception as e:
         logger.error(f"Error in /add: {str(e)}")
-        await update.message.reply_text("An error occurred.")
+        await outbox.send_message(update.effective_chat.id, "An error occurred.")
 
 # 新增 /maimai 命令处理器
 async def maimai_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         player_id = context.args[0]  # 获取玩家ID
-        profile = get_maimai_player_profile(player_id)
+        profile = await maimai_client.get_profile(player_id)
         if "error" in profile:
-            await update.message.reply_text(profile["error"])
+            await outbox.send_message(update.effective_chat.id, profile["error"])
         else:
             # 格式化并发送玩家资料
             profile_text = f"玩家 ID: {profile['player_id']}\n"
             profile_text += f"昵称: {profile['nickname']}\n"
             profile_text += f"等级: {profile['level']}\n"
             # 添加更多字段根据需要
-            await update.message.reply_text(profile_text)
+            await outbox.send_message(update.effective_chat.id, profile_text)
     else:
-        await update.message.reply_text("请提供玩家 ID，例如：/maimai 玩家123")
+        await outbox.send_message(update.effective_chat.id, "请提供玩家好友码，例如：/maimai 123456789")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await outbox.send_message(
+        update.effective_chat.id,
         "Available commands:\n"
         "/add <keyword> - Count keyword usage\n"
         "/help - Show help\n"
@@ -107,49 +130,229 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def hello_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
-        await update.message.reply_text(f"Good day, {context.args[0]}!")
+        await outbox.send_message(update.effective_chat.id, f"Good day, {context.args[0]}!")
     else:
-        await update.message.reply_text("Usage: /hello <name>")
+        await outbox.send_message(update.effective_chat.id, "Usage: /hello <name>")
+
+# 准入被拒绝时的快速回复，不让用户干等到超时
+ADMISSION_REPLIES = {
+    RATE_LIMITED: "哼，你说得太快了啦！让我喘口气再说… (｀へ´)",
+    OVERLOADED: "现在找我的人太多了，笨蛋，过一会儿再来吧～",
+}
+
+# 不调用 LLM 的轻量命令，webhook 收到后优先处理
+CHEAP_COMMANDS = ("/help", "/hello")
+
+def is_cheap_command(update: Update) -> bool:
+    text = update.message.text if update.message else None
+    if not text:
+        return False
+    command = text.split(maxsplit=1)[0].split("@", 1)[0]
+    return command in CHEAP_COMMANDS
 
 async def equiped_chatgpt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_message = update.message.text
         user_id = update.effective_user.id  # 提取用户 ID
-        reply = chatgpt.submit(user_message, user_id=user_id)
+
+        # LLM 名额只在生成回复期间占用；发送回复、等待表情包和推荐时不占，其他用户的请求可以进来
+        if STREAM_REPLIES:
+            # 流式模式：边生成边编辑同一条消息（上游连接在整个流期间都被占用）
+            sender = StreamingMessageSender(outbox, update.effective_chat.id)
+            reply = {}
+            async with llm_admission.admit(user_id):
+                async for event in chatgpt.submit_stream(user_message, user_id=user_id):
+                    if "delta" in event:
+                        await sender.push(event["delta"])
+                    else:
+                        reply = event
+            await sender.finish(reply.get("text"))
+        else:
+            async with llm_admission.admit(user_id):
+                reply = await chatgpt.submit(user_message, user_id=user_id)
+            if isinstance(reply, dict):
+                # 先发文本
+                await outbox.send_message(chat_id=update.effective_chat.id, text=reply["text"])
 
         if isinstance(reply, dict):
-            # 先发文本
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=reply["text"])
-            # 如果有图，就发图
-            if "image_url" in reply:
-                await context.bot.send_photo(chat_id=update.effective_chat.id, photo=reply["image_url"])
+            # 表情包和推荐在独立任务里等待和发送，不占住处理这个聊天的工作协程
+            task = asyncio.ensure_future(send_followups(update.effective_chat.id, user_message, reply))
+            followup_tasks.add(task)
+            task.add_done_callback(followup_tasks.discard)
         else:
             # 回退兼容
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=str(reply))
+            await outbox.send_message(chat_id=update.effective_chat.id, text=str(reply))
 
+    except AdmissionRejected as e:
+        await outbox.send_message(chat_id=update.effective_chat.id, text=ADMISSION_REPLIES[e.reason])
     except Exception as e:
         logger.error(f"ChatGPT Error: {str(e)}")
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="⚠️ Error responding.")
+        await outbox.send_message(chat_id=update.effective_chat.id, text="⚠️ Error responding.")
+
+async def send_followups(chat_id, user_message, reply):
+    try:
+        # 表情包和推荐在后台并发获取，按时拿到的作为后续消息发送
+        followups = await reply["followups"] if "followups" in reply else reply
+        # 表情包和推荐带同一个 merge_key 一起入队，发送队列会把它们合并成一条带说明的图片
+        merge_key = object()
+        sends = []
+        if "image_url" in followups:
+            # 发过的图片直接用 file_id，Telegram 不用再下载一次
+            image_url = followups["image_url"]
+            media_cache.note_query(user_message)
+            photo = outbox.send_photo(chat_id=chat_id, photo=media_cache.photo_for(image_url), merge_key=merge_key)
+            sends.append(media_cache.track(image_url, photo))
+        recommendations_text = format_recommendations(followups.get("recommendations"))
+        if recommendations_text:
+            sends.append(outbox.send_message(chat_id=chat_id, text=recommendations_text, merge_key=merge_key))
+        await asyncio.gather(*sends)
+    except Exception as e:
+        logger.error(f"Failed to send followups: {str(e)}")
 
 # === Webhook 端点 ===
-@app.route("/")
+@bot.route("/")
 async def health_check():
     return "🤖 Bot is running on Webhook!", 200
 
-@app.route("/webhook", methods=["POST"])
+def current_readiness():
+    """
+    活动索引和会话预加载的状态在请求时读取：首个快照晚于预热结束才到达、
+    或预加载失败后，/ready 也能变为 200，而不是停在预热那一刻的结果上
+    """
+    components = dict(readiness)
+    if chatgpt is not None:
+        components["event_index"] = chatgpt.event_index is not None and chatgpt.event_index.ready.is_set()
+        components["sessions"] = chatgpt.sessions_prefetched.is_set()
+    return components
+
+@bot.route("/ready")
+async def readiness_check():
+    """ 就绪检查：Firestore、Telegram、连接池和活动索引都预热完成后才返回 200 """
+    components = current_readiness()
+    ready = STARTUP.ready_seconds is not None and all(components.get(name) for name in READY_COMPONENTS)
+    body = {"ready": ready, "components": components, "startup": STARTUP.report()}
+    return body, 200 if ready else 503
+
+@bot.route("/metrics")
+async def metrics_endpoint():
+    return REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@bot.route("/webhook", methods=["POST"])
 async def telegram_webhook():
-    update = Update.de_json(await request.get_json(), telegram_app.bot)
+    with span("webhook"):
+        payload = await request.get_json()
+        update = Update.de_json(payload, telegram_app.bot)
+        new_trace_id(update.update_id)
+
+        if not telegram_app._initialized:
+            await telegram_app.initialize()
+            readiness["telegram"] = True
+
+        # 另一个工作进程已经接手了这条更新（Telegram 重发）
+        if shared_dedupe is not None and not await shared_dedupe.claim(update.update_id):
+            return "ok", 200
+
+        # 只入队不等待处理，Telegram 不会因为 LLM 慢而超时重发
+        status = update_dispatcher.submit(update)
+        if status == REJECTED:
+            if shared_dedupe is not None:
+                await shared_dedupe.release(update.update_id)
+            return "busy", 503
+        # 只采集真正入队的更新：本地去重丢掉的重发和 503 后 Telegram 的重试不会被重放两次
+        # （入队后工作协程要等这里让出事件循环才开始处理，阶段耗时仍能对上这条更新）
+        if status == ACCEPTED and traffic_recorder is not None:
+            traffic_recorder.record_update(payload)
+        return "ok", 200
+
+@bot.before_app_serving
+async def startup():
+    """
+    冷启动：Firestore 客户端（导入 grpc、加载凭据，放到线程里）和 Telegram Bot（getMe）并发初始化，
+    完成后才开始接收请求；建连、活动索引和 set_webhook 在后台预热，完成后 /ready 变为 200。
+    已经通过 setup() 注入依赖（如压测）时跳过 Firestore 初始化。
+    """
+    if chatgpt is None:
+        with STARTUP.phase("init"):
+            build_telegram_app()
+            firestore_db, _ = await asyncio.gather(
+                asyncio.to_thread(timed_phase, "firestore", init_firestore),
+                initialize_telegram(),
+            )
+            with STARTUP.phase("setup"):
+                setup(firestore_db)
+    startup_tasks.add(asyncio.ensure_future(warm_up()))
+
+def timed_phase(name, func):
+    with STARTUP.phase(name):
+        return func()
+
+async def initialize_telegram():
+    try:
+        with STARTUP.phase("telegram"):
+            await telegram_app.initialize()
+        readiness["telegram"] = True
+    except Exception as e:
+        # 失败时由第一个 webhook 请求重试初始化
+        readiness["telegram"] = False
+        logger.error(f"Telegram initialization failed: {str(e)}")
+
+async def warm_up():
+    with STARTUP.phase("warm_up"):
+        jobs = [chatgpt.warm_up(), asyncio.to_thread(media_cache.load)]
+        if not telegram_app._initialized:
+            jobs.append(initialize_telegram())
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        if isinstance(results[0], BaseException):
+            logger.error(f"Warm-up failed: {str(results[0])}")
+        else:
+            readiness.update(results[0])
+        # file_id 缓存只是优化，加载失败时照常用 URL 发送
+        readiness["media_cache"] = not isinstance(results[1], BaseException)
+        if media_warmer is not None:
+            media_warmer.start()
+
+        # 设置 Webhook
+        webhook_url = os.getenv("WEBHOOK_URL")
+        if webhook_url and telegram_app._initialized:
+            try:
+                await telegram_app.bot.set_webhook(webhook_url)
+                logger.info(f"🌐 Webhook set to: {webhook_url}")
+            except Exception as e:
+                logger.error(f"Failed to set webhook: {str(e)}")
+        elif not webhook_url:
+            logger.warning("⚠️ WEBHOOK_URL not set!")
+    STARTUP.mark_ready()
 
-    if not telegram_app._initialized:
-        await telegram_app.initialize()
-    await telegram_app.process_update(update)
-    return "ok", 200
+@bot.after_app_serving
+async def shutdown():
+    # 退出前处理完已入队的更新，再刷完关键词计数和对话写入队列
+    for task in startup_tasks:
+        task.cancel()
+    if update_dispatcher is not None:
+        await update_dispatcher.aclose()
+    if followup_tasks:
+        await asyncio.gather(*followup_tasks, return_exceptions=True)
+    if media_warmer is not None:
+        await media_warmer.aclose()
+    if outbox is not None:
+        await outbox.aclose()
+    if media_cache is not None:
+        await asyncio.to_thread(media_cache.close)
+    if keyword_counter is not None:
+        await keyword_counter.aclose()
+    if maimai_client is not None:
+        await maimai_client.aclose()
+    if chatgpt is not None:
+        await chatgpt.aclose()
+    if traffic_recorder is not None:
+        traffic_recorder.close()
 
 # === 主函数：初始化服务 ===
-def main():
-    global telegram_app, chatgpt, db
+def init_firestore():
+    """ 初始化 Firebase 并返回 Firestore 客户端 """
+    import firebase_admin
+    from firebase_admin import credentials, firestore
 
-    # 初始化 Firebase
     firebase_config = os.getenv("FIREBASE_CONFIG")
     if firebase_config:
         cred = credentials.Certificate(json.loads(firebase_config))
@@ -158,7 +361,38 @@ def main():
         cred = credentials.Certificate(firebase_key_path)
 
     firebase_admin.initialize_app(cred)
-    db = firestore.client()
+    return firestore.client()
+
+def build_telegram_app(telegram_base_url=None):
+    """ 创建 Telegram 应用并注册指令处理器（不需要 Firestore，可与其初始化并发进行） """
+    global telegram_app
+
+    token = get_config("TELEGRAM", "ACCESS_TOKEN")
+    # 更新由 UpdateDispatcher 直接调用 process_update 处理，并发度在那里控制
+    builder = ApplicationBuilder().token(token)
+    if telegram_base_url:
+        builder = builder.base_url(telegram_base_url)
+    telegram_app = builder.build()
+
+    # 添加指令处理器
+    telegram_app.add_handler(CommandHandler("add", add))
+    telegram_app.add_handler(CommandHandler("help", help_command))
+    telegram_app.add_handler(CommandHandler("hello", hello_command))
+    telegram_app.add_handler(CommandHandler("maimai", maimai_command))  # 添加 /maimai 命令
+    telegram_app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), equiped_chatgpt))
+    return telegram_app
+
+def setup(firestore_db, telegram_base_url=None):
+    """
+    创建 ChatGPT 客户端、Telegram 应用和各个后台组件。
+    压测时传入内存版 Firestore 和本地 Telegram 桩服务地址即可脱离真实服务运行。
+    """
+    global chatgpt, db, keyword_counter, update_dispatcher, llm_admission, shared_dedupe, maimai_client, outbox
+    global media_cache, media_warmer, traffic_recorder
+
+    db = firestore_db
+    keyword_counter = ShardedCounter(db, num_shards=int(get_config("FIRESTORE", "KEYWORD_COUNTER_SHARDS", "10")))
+    readiness["firestore"] = True
     logger.info("✅ Firestore initialized.")
 
     # 初始化 ChatGPT，并传入 Firestore 数据库
@@ -170,26 +404,82 @@ def main():
         firestore_db=db,
     )
 
+    # 舞萌查分和 ChatGPT 共用同一个按主机划分的连接池
+    maimai_client = MaimaiClient.from_env(chatgpt.http_pool)
+
     # 初始化 Telegram Bot
-    token = get_config("TELEGRAM", "ACCESS_TOKEN")
-    telegram_app = ApplicationBuilder().token(token).build()
+    if telegram_app is None:
+        build_telegram_app(telegram_base_url)
+    readiness.setdefault("telegram", telegram_app._initialized)
+    outbox = TelegramOutbox(
+        telegram_app.bot,
+        global_rate=float(get_config("TELEGRAM", "GLOBAL_RATE", "30")),
+        per_chat_rate=float(get_config("TELEGRAM", "PER_CHAT_RATE", "1")),
+        per_chat_burst=int(get_config("TELEGRAM", "PER_CHAT_BURST", "3")),
+        group_rate=float(get_config("TELEGRAM", "GROUP_RATE_PER_MIN", "20")) / 60,
+    )
+    media_cache = MediaFileCache.from_env(db)
+    warm_chat_id = get_config("MEDIA", "WARM_CHAT_ID", "")
+    if warm_chat_id:
+        media_warmer = MediaCacheWarmer(
+            media_cache,
+            fetch_urls=lambda query: chatgpt.try_fetch_vvquest_image(query, n=1),
+            sender=outbox,
+            warm_chat_id=int(warm_chat_id),
+            interval=float(get_config("MEDIA", "WARM_INTERVAL", "600")),
+        )
+    update_dispatcher = UpdateDispatcher(
+        telegram_app.process_update,
+        num_workers=int(get_config("WEBHOOK", "WORKERS", "8")),
+        queue_size=int(get_config("WEBHOOK", "QUEUE_SIZE", "100")),
+        overflow=get_config("WEBHOOK", "OVERFLOW_POLICY", "backpressure"),
+        is_priority=is_cheap_command,
+        max_block=float(get_config("WEBHOOK", "MAX_BLOCK", "20")),
+    )
+    llm_admission = AdmissionController(
+        per_user_rate=float(get_config("LLM", "USER_RATE_PER_MIN", "12")) / 60,
+        per_user_burst=int(get_config("LLM", "USER_BURST", "3")),
+        max_concurrent=int(get_config("LLM", "MAX_CONCURRENT", "8")),
+        max_wait=float(get_config("LLM", "MAX_WAIT", "5")),
+        shared_limiter=RedisRateLimiter.from_env(),
+    )
+    shared_dedupe = RedisUpdateDedupe.from_env()
+    traffic_recorder = TrafficRecorder.from_env()
 
-    # 添加指令处理器
-    telegram_app.add_handler(CommandHandler("add", add))
-    telegram_app.add_handler(CommandHandler("help", help_command))
-    telegram_app.add_handler(CommandHandler("hello", hello_command))
-    telegram_app.add_handler(CommandHandler("maimai", maimai_command))  # 添加 /maimai 命令
-    telegram_app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), equiped_chatgpt))
+    # 各组件的运行状态导出到 /metrics
+    REGISTRY.register_stats("startup", STARTUP.stats)
+    REGISTRY.register_stats("webhook", update_dispatcher.stats)
+    REGISTRY.register_stats("admission", llm_admission.stats)
+    REGISTRY.register_stats("upstream", chatgpt.upstream.stats)
+    REGISTRY.register_stats("session", chatgpt.memory.stats)
+    REGISTRY.register_stats("sticker_cache", chatgpt.sticker_cache.stats)
+    REGISTRY.register_stats("recommendation_cache", chatgpt.recommendation_cache.stats)
+    REGISTRY.register_stats("maimai", maimai_client.stats)
+    REGISTRY.register_stats("telegram_outbox", outbox.stats)
+    REGISTRY.register_stats("media_cache", media_cache.stats)
+    if chatgpt.writer is not None:
+        REGISTRY.register_stats("firestore_writer", chatgpt.writer.stats)
+    if chatgpt.semantic_cache is not None:
+        REGISTRY.register_stats("semantic_cache", chatgpt.semantic_cache.stats)
+    if shared_dedupe is not None:
+        REGISTRY.register_stats("shared_dedupe", shared_dedupe.stats)
+    if traffic_recorder is not None:
+        REGISTRY.register_stats("traffic_capture", traffic_recorder.stats)
 
-    # 设置 Webhook
-    webhook_url = os.getenv("WEBHOOK_URL")
-    if webhook_url:
-        asyncio.run(telegram_app.bot.set_webhook(webhook_url))
-        logger.info(f"🌐 Webhook set to: {webhook_url}")
-    else:
-        logger.warning("⚠️ WEBHOOK_URL not set!")
+def create_app():
+    """
+    ASGI 应用工厂，供 Hypercorn / Uvicorn 在每个工作进程里调用：
+        hypercorn --config file:hypercorn_config.py "chatbot_quart:create_app()"
+    Firestore、Telegram 等资源在 lifespan（before_serving / after_serving）里创建和释放。
+    """
+    quart_app = Quart(__name__)
+    quart_app.register_blueprint(bot)
+    return quart_app
+
+app = create_app()
 
 # === 启动入口 ===
 if __name__ == "__main__":
-    main()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
+    # 本地开发用的单进程服务器；生产环境用 Hypercorn 多进程运行 create_app()，见 Dockerfile
+    # Firestore、Telegram 等在 startup() 中并发初始化，进程启动后尽快开始监听端口
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
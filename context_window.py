@@ -0,0 +1,74 @@
+import os
+import re
+from collections import namedtuple
+
+# 中日韩文字大致 1 字 1 token；其他文本按 4 个字符 1 token 估算
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+# 每条消息的固定开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text) -> int:
+    """不依赖分词器的本地 token 估算"""
+    if not text:
+        return MESSAGE_OVERHEAD_TOKENS
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+# first_seq 是 items[0] 的序号；summary 为 (covered_seq, text) 或 None
+HistoryWindow = namedtuple("HistoryWindow", ["items", "first_seq", "summary"])
+
+
+class ContextBuilder:
+    """
+    按 token 预算组装发给 ChatGPT 的上下文：
+    系统提示和当前消息必带，历史从新到旧装入，装不下的旧消息被丢弃。
+    summarize=True 时，被丢弃的旧消息会压缩成一条缓存的摘要放在历史前面。
+    """
+
+    def __init__(self, budget_tokens=1500, summarize=False):
+        self.budget_tokens = budget_tokens
+        self.summarize = summarize
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            budget_tokens=int(os.getenv("CHATGPT_CONTEXT_TOKENS", "1500")),
+            summarize=os.getenv("CHATGPT_CONTEXT_SUMMARY", "0") == "1",
+        )
+
+    def build(self, system_prompt, message, window):
+        """返回 (messages, dropped)，dropped 是因超出预算而没有放进上下文的历史"""
+        messages = [{"role": "system", "content": system_prompt}]
+        used = estimate_tokens(system_prompt) + estimate_tokens(message)
+
+        if self.summarize and window.summary:
+            summary_text = window.summary[1]
+            messages.append({"role": "system", "content": f"之前的对话摘要：{summary_text}"})
+            used += estimate_tokens(summary_text)
+
+        kept = 0
+        for _, _, tokens in reversed(window.items):
+            if used + tokens > self.budget_tokens:
+                break
+            used += tokens
+            kept += 1
+
+        split = len(window.items) - kept
+        for role, content, _ in window.items[split:]:
+            messages.append({"role": role.name.lower(), "content": content})
+        messages.append({"role": "user", "content": message})
+        return messages, window.items[:split]
+
+    def pending_summary(self, window, dropped):
+        """返回尚未被摘要覆盖的被丢弃消息及其最后一条的序号；无需更新时返回 ([], None)"""
+        if not self.summarize or not dropped:
+            return [], None
+        covered = window.summary[0] if window.summary else -1
+        last_seq = window.first_seq + len(dropped) - 1
+        if last_seq <= covered:
+            return [], None
+        start = max(0, covered + 1 - window.first_seq)
+        return dropped[start:], last_seq
@@ -0,0 +1,147 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+# CJK 连续片段单独切分，其余按单词切分
+_TOKEN_RE = re.compile(
+    r"(?P<cjk>[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+)|(?P<word>\w+)"
+)
+
+
+def normalize(text) -> str:
+    """全角转半角 + 大小写折叠"""
+    return unicodedata.normalize("NFKC", str(text)).casefold()
+
+
+def tokenize(text, cjk_ngram=2) -> set:
+    """
+    把文本切成 token 集合。
+    英文/数字按单词切分；中日韩文字没有空格，按 cjk_ngram 长度切 n-gram
+    （cjk_ngram=0 时整段作为一个 token）。
+    """
+    tokens = set()
+    for match in _TOKEN_RE.finditer(normalize(text)):
+        run = match.group("cjk")
+        if run is None:
+            tokens.add(match.group("word"))
+        elif not cjk_ngram or len(run) <= cjk_ngram:
+            tokens.add(run)
+        else:
+            for i in range(len(run) - cjk_ngram + 1):
+                tokens.add(run[i:i + cjk_ngram])
+    return tokens
+
+
+class EventKeywordIndex:
+    """
+    活动关键词的本地倒排索引。
+    通过 Firestore on_snapshot 监听（或轮询）增量更新，查询时不再读取 Firestore，
+    结果按匹配得分（命中 token 的 idf 之和）排序。
+    """
+
+    def __init__(self, cjk_ngram=2):
+        self.cjk_ngram = cjk_ngram
+        self._docs = {}                       # doc_id -> (event, tokens)
+        self._postings = defaultdict(set)     # token -> {doc_id}
+        self._lock = threading.Lock()
+        self._watch = None
+        self._poll_stop = None
+        self.ready = threading.Event()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _event_tokens(self, event):
+        tokens = set()
+        for keyword in event.get("keywords", []) or []:
+            tokens |= tokenize(keyword, self.cjk_ngram)
+        return tokens
+
+    def upsert(self, doc_id, event):
+        tokens = self._event_tokens(event)
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._docs[doc_id] = (event, tokens)
+            for token in tokens:
+                self._postings[token].add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id):
+        old = self._docs.pop(doc_id, None)
+        if old is None:
+            return
+        for token in old[1]:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[token]
+
+    def search(self, message, limit=5) -> list:
+        """返回与消息匹配的活动，得分高的在前"""
+        query_tokens = tokenize(message, self.cjk_ngram)
+        scores = defaultdict(float)
+        with self._lock:
+            total = len(self._docs)
+            for token in query_tokens:
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + total / len(postings))
+                for doc_id in postings:
+                    scores[doc_id] += idf
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return [self._docs[doc_id][0] for doc_id, _ in ranked]
+
+    # === 数据源 ===
+    def attach(self, collection_ref, poll_interval=60.0):
+        """优先使用 on_snapshot 实时监听；不支持监听的客户端（如测试替身）改用轮询"""
+        if hasattr(collection_ref, "on_snapshot"):
+            self._watch = collection_ref.on_snapshot(self._on_snapshot)
+        else:
+            self.start_polling(collection_ref, poll_interval)
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        for change in changes:
+            if change.type.name == "REMOVED":
+                self.remove(change.document.id)
+            else:
+                self.upsert(change.document.id, change.document.to_dict() or {})
+        self.ready.set()
+
+    def poll_once(self, collection_ref):
+        """完整读取一次集合，并与本地索引做差量同步"""
+        seen = set()
+        for doc in collection_ref.stream():
+            seen.add(doc.id)
+            self.upsert(doc.id, doc.to_dict() or {})
+        with self._lock:
+            stale = [doc_id for doc_id in self._docs if doc_id not in seen]
+            for doc_id in stale:
+                self._remove_locked(doc_id)
+        self.ready.set()
+
+    def start_polling(self, collection_ref, interval=60.0):
+        self._poll_stop = threading.Event()
+
+        def loop():
+            while not self._poll_stop.is_set():
+                try:
+                    self.poll_once(collection_ref)
+                except Exception as e:
+                    print(f"⚠️ 活动索引同步失败: {e}")
+                self._poll_stop.wait(interval)
+
+        threading.Thread(target=loop, name="event-index-poller", daemon=True).start()
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        if self._poll_stop is not None:
+            self._poll_stop.set()
@@ -0,0 +1,159 @@
+import datetime
+import threading
+import uuid
+
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    def set(self, data, merge=False):
+        self._db._rpc()
+        self._db._write(self.path, data, merge)
+
+    def update(self, data):
+        self.set(data, merge=True)
+
+    def get(self):
+        self._db._rpc()
+        return FakeDocumentSnapshot(self, self._db._read(self.path))
+
+    def delete(self):
+        self._db._rpc()
+        self._db._delete(self.path)
+
+
+class FakeQuery:
+    def __init__(self, collection, orders=(), limit_count=None):
+        self._collection = collection
+        self._orders = list(orders)
+        self._limit = limit_count
+
+    def order_by(self, field, direction="ASCENDING"):
+        return FakeQuery(self._collection, self._orders + [(field, direction)], self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self._collection, self._orders, count)
+
+    def stream(self):
+        docs = self._collection._documents()
+        for field, direction in reversed(self._orders):
+            docs.sort(key=lambda item: item[1].get(field), reverse=str(direction).upper() == "DESCENDING")
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        for path, data in docs:
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._collection._db, path), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(self)
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._db, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def _documents(self):
+        self._db._rpc()
+        prefix = self.path + "/"
+        with self._db._lock:
+            return [
+                (path, dict(data)) for path, data in self._db._docs.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            ]
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference.path, data, merge))
+
+    def update(self, reference, data):
+        self.set(reference, data, merge=True)
+
+    def commit(self):
+        self._db._rpc()
+        for path, data, merge in self._writes:
+            self._db._write(path, data, merge)
+        self._db.batch_commits += 1
+        return []
+
+
+class FakeFirestore:
+    """
+    测试和压测用的内存版 Firestore，只实现本项目用到的接口：
+    collection/document/set/get/stream/order_by/limit/batch，
+    以及 SERVER_TIMESTAMP 和 Increment 两种字段变换。
+    rpc_count 记录等价的 RPC 次数，方便比较优化前后的调用量。
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.Lock()
+        self.rpc_count = 0
+        self.batch_commits = 0
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def _rpc(self):
+        with self._lock:
+            self.rpc_count += 1
+
+    def _read(self, path):
+        with self._lock:
+            data = self._docs.get(path)
+            return dict(data) if data is not None else None
+
+    def _delete(self, path):
+        with self._lock:
+            self._docs.pop(path, None)
+
+    def _write(self, path, data, merge):
+        with self._lock:
+            current = dict(self._docs.get(path) or {}) if merge else {}
+            for key, value in data.items():
+                current[key] = self._transform(value, current.get(key))
+            self._docs[path] = current
+
+    def _transform(self, value, old):
+        if value is SERVER_TIMESTAMP:
+            return datetime.datetime.now(datetime.timezone.utc)
+        if type(value).__name__ == "Increment":
+            return (old or 0) + value.value
+        return value
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import random
+import time
+
+from metrics import STAGE_SECONDS, trace_id_var
+
+logger = logging.getLogger(__name__)
+
+
+class FirestoreWriteBehind:
+    """
+    Firestore 写后（write-behind）队列。
+    调用方只把写操作放进队列就返回，后台任务把多个用户的写入合并成 batch 提交：
+    攒够 max_batch 条或距第一条入队超过 flush_interval 秒就提交一次。
+    提交失败按指数退避（带抖动）重试，关闭时会把剩余写入全部刷完。
+    每个写入记下入队时的 trace_id，后台提交失败时日志里能对应到是哪些请求的写入。
+    """
+
+    # Firestore 单个 batch 最多 500 个写操作
+    FIRESTORE_BATCH_LIMIT = 500
+
+    def __init__(self, db, max_batch=400, flush_interval=0.5, max_queue=10000, max_retries=5,
+                 base_backoff=0.2, max_backoff=10.0):
+        self.db = db
+        self.max_batch = min(max_batch, self.FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._queue = None
+        self._task = None
+        self._closing = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.commits = 0
+        self.retries = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.ensure_future(self._run())
+
+    def enqueue(self, doc_ref, data, merge=False) -> bool:
+        """放入一个写操作（需在事件循环内调用）；队列已满时丢弃并返回 False"""
+        if self._closing:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((doc_ref, data, merge, trace_id_var.get()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error(f"❌ Firestore 写入队列已满，丢弃写入: {doc_ref.path}")
+            return False
+        self.enqueued += 1
+        return True
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            items = [first]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(items) < self.max_batch:
+                if self._queue.empty():
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+            await self._commit_with_retry(items)
+            if stop:
+                return
+
+    async def _commit_with_retry(self, items):
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.to_thread(self._commit, items)
+                self.commits += 1
+                self.written += len(items)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(items)
+                    logger.error(f"❌ Firestore 批量写入失败，放弃 {len(items)} 条 (traces: {self._traces(items)}): {e}")
+                    break
+                self.retries += 1
+                backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                logger.warning(f"⚠️ Firestore 批量写入失败，{backoff:.1f}s 后重试 (traces: {self._traces(items)}): {e}")
+                await asyncio.sleep(random.uniform(backoff / 2, backoff))
+        self.last_flush_seconds = time.monotonic() - started
+        self.total_flush_seconds += self.last_flush_seconds
+        STAGE_SECONDS.observe(self.last_flush_seconds, stage="persistence")
+
+    @staticmethod
+    def _traces(items, limit=10):
+        traces = list(dict.fromkeys(trace for *_, trace in items))
+        more = f" +{len(traces) - limit}" if len(traces) > limit else ""
+        return ",".join(traces[:limit]) + more
+
+    def _commit(self, items):
+        batch = self.db.batch()
+        for doc_ref, data, merge, _ in items:
+            batch.set(doc_ref, data, merge=merge)
+        batch.commit()
+
+    async def aclose(self):
+        """停止接收新写入，并等待队列里剩余的写入全部提交"""
+        self._closing = True
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(None)
+        await self._task
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "commits": self.commits,
+            "retries": self.retries,
+            "last_flush_seconds": self.last_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.commits if self.commits else 0.0,
+        }
@@ -0,0 +1,75 @@
+import asyncio
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class HTTPPool:
+    """
+    按主机划分的共享 keep-alive 连接池。
+    每个上游主机（HKBU、VVQuest、舞萌 API……）各自一个 httpx.AsyncClient，
+    这样连接数上限是按主机计算的，一个慢上游不会占满其他上游的连接。
+    """
+
+    def __init__(self, max_connections_per_host=20, max_keepalive_per_host=10, keepalive_expiry=30.0,
+                 connect_timeout=5.0, read_timeout=60.0, write_timeout=10.0, pool_timeout=5.0):
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_keepalive_per_host,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout,
+        )
+        self._clients = {}
+
+    def client_for(self, url) -> httpx.AsyncClient:
+        """返回负责该 URL 所在主机的客户端（首次使用时创建）"""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(host)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            self._clients[host] = client
+        return client
+
+    async def get(self, url, **kwargs) -> httpx.Response:
+        return await self.client_for(url).get(url, **kwargs)
+
+    async def post(self, url, **kwargs) -> httpx.Response:
+        return await self.client_for(url).post(url, **kwargs)
+
+    def stream(self, method, url, **kwargs):
+        """流式请求，用法：async with pool.stream("POST", url, ...) as response"""
+        return self.client_for(url).stream(method, url, **kwargs)
+
+    async def warm(self, url, timeout=3.0) -> bool:
+        """
+        预先建立到该主机的连接（DNS + TCP + TLS），让第一个真实请求复用 keep-alive 连接。
+        只发一个 HEAD 请求，任何状态码都算成功；失败不影响正常服务。
+        """
+        parts = urlsplit(url)
+        try:
+            await self.client_for(url).head(f"{parts.scheme}://{parts.netloc}/", timeout=timeout)
+            return True
+        except httpx.HTTPError:
+            return False
+
+    async def aclose(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+
+_default_pool = None
+
+
+def get_default_pool() -> HTTPPool:
+    """进程内共享的默认连接池"""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = HTTPPool()
+    return _default_pool
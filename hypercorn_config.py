@@ -0,0 +1,35 @@
+"""
+Hypercorn 生产环境配置：hypercorn --config file:hypercorn_config.py "chatbot_quart:create_app()"
+
+WEB_CONCURRENCY 指定工作进程数。会话、update 去重和用户限流默认保存在各进程内存里，
+同一用户的请求落到不同进程会看到不同的历史和限额，所以：
+- 配置了 SESSION_REDIS_URL / SHARED_REDIS_URL 时默认等于本容器可用的 CPU 数（Cloud Run 实例的 vCPU 数）
+- 否则默认只用 1 个工作进程；显式设置 WEB_CONCURRENCY > 1 而没有共享后端时拒绝启动
+"""
+import os
+
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = [f"0.0.0.0:{os.getenv('PORT', '8080')}"]
+shared_backend = os.getenv("SESSION_REDIS_URL") or os.getenv("SHARED_REDIS_URL")
+workers = int(os.getenv("WEB_CONCURRENCY") or (_available_cpus() if shared_backend else 1))
+if workers > 1 and not shared_backend:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} requires SESSION_REDIS_URL or SHARED_REDIS_URL: "
+        "sessions, update dedupe and rate limits would otherwise differ between workers"
+    )
+# 每个工作进程内的协程都跑在 asyncio 事件循环上；装了 uvloop 时可设 HYPERCORN_WORKER_CLASS=uvloop
+worker_class = os.getenv("HYPERCORN_WORKER_CLASS", "asyncio")
+keep_alive_timeout = 75  # 长于 Cloud Run 前端的空闲超时，避免连接被提前关闭
+graceful_timeout = float(os.getenv("HYPERCORN_GRACEFUL_TIMEOUT", "8"))  # Cloud Run 发 SIGTERM 后约 10 秒强制结束
+accesslog = None
+errorlog = "-"
+
+# 子进程需要知道自己处在多进程部署里（见 session_store.LRUSessionStore.from_env）
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
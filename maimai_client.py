@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+
+import httpx
+
+from admission import TokenBucket
+from metrics import timed
+from upstream import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+PROFILE_UNAVAILABLE = "无法获取玩家资料"
+PLAYER_NOT_FOUND = "找不到这个玩家"
+INVALID_PLAYER_ID = "玩家 ID 应为好友码（纯数字）"
+
+# 查分器按好友码查询；ID 会拼进带开发者令牌的请求路径，只接受纯数字，防止 "../" 或 "?" 改写请求地址
+_FRIEND_CODE_RE = re.compile(r"[0-9]{1,20}")
+
+
+class MaimaiClient:
+    """
+    舞萌 DX 查分器（maimai.lxns.net）玩家资料的异步客户端。
+    - 走共享的 HTTPPool，复用 keep-alive 连接，带超时
+    - 按玩家缓存：ttl 内直接返回；过期但未超过 stale_ttl 时先返回旧数据，同时在后台刷新（stale-while-revalidate）
+    - 同一玩家的并发查询共用一次上游请求
+    - 后台批量刷新最常被查询的玩家，按 refresh_rate（次/秒）限速，遇到 429 按 Retry-After 暂停
+    """
+
+    def __init__(self, pool, base_url, token=None, ttl=300.0, stale_ttl=3600.0, negative_ttl=60.0, timeout=5.0,
+                 max_players=5000, refresh_rate=1.0, refresh_top=50, refresh_interval=60.0, clock=time.monotonic):
+        self.pool = pool
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = httpx.Timeout(timeout)
+        self.max_players = max_players
+        self.refresh_top = refresh_top
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._bucket = TokenBucket(refresh_rate, max(1.0, refresh_rate), clock())
+        self._paused_until = 0.0
+
+        self._entries = OrderedDict()   # player_id -> (profile, fetched_at)
+        self._inflight = {}
+        self._popularity = Counter()
+        self._refresher = None
+        self._background = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self.refreshed = 0
+
+    @classmethod
+    def from_env(cls, pool):
+        return cls(
+            pool,
+            base_url=os.getenv("MAIMAI_API_URL", "https://maimai.lxns.net"),
+            token=os.getenv("MAIMAI_DEVELOPER_TOKEN"),
+            ttl=float(os.getenv("MAIMAI_CACHE_TTL", "300")),
+            stale_ttl=float(os.getenv("MAIMAI_STALE_TTL", "3600")),
+            refresh_rate=float(os.getenv("MAIMAI_REFRESH_RATE", "1")),
+            refresh_top=int(os.getenv("MAIMAI_REFRESH_TOP", "50")),
+        )
+
+    # === 查询 ===
+    async def get_profile(self, player_id) -> dict:
+        """返回 {"player_id", "nickname", "level"}；失败时返回 {"error": ...}"""
+        player_id = str(player_id).strip()
+        if not _FRIEND_CODE_RE.fullmatch(player_id):
+            return {"error": INVALID_PLAYER_ID}
+        self._popularity[player_id] += 1
+        self._ensure_refresher()
+
+        entry = self._entries.get(player_id)
+        if entry is not None:
+            profile, fetched_at = entry
+            age = self._clock() - fetched_at
+            ttl = self.negative_ttl if "error" in profile else self.ttl
+            if age <= ttl:
+                self.hits += 1
+                self._entries.move_to_end(player_id)
+                return profile
+            if age <= self.stale_ttl and "error" not in profile:
+                self.stale_hits += 1
+                self._entries.move_to_end(player_id)
+                self._spawn(self._load(player_id))
+                return profile
+
+        self.misses += 1
+        return await self._load(player_id)
+
+    async def _load(self, player_id):
+        """同一玩家同时只有一个上游请求，并发的查询共用同一个结果（包括失败时的兜底结果）"""
+        future = self._inflight.get(player_id)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(self._fetch_and_store(player_id))
+        self._inflight[player_id] = future
+        future.add_done_callback(lambda _: self._inflight.pop(player_id, None))
+        return await asyncio.shield(future)
+
+    async def _fetch_and_store(self, player_id):
+        """请求失败时有旧数据就继续用旧数据，否则返回错误结果，不会返回 None"""
+        profile = await self._fetch(player_id)
+        if profile is not None:
+            self._store(player_id, profile)
+            return profile
+        entry = self._entries.get(player_id)
+        if entry is not None and "error" not in entry[0]:
+            return entry[0]
+        return {"error": PROFILE_UNAVAILABLE}
+
+    def _store(self, player_id, profile):
+        self._entries[player_id] = (profile, self._clock())
+        self._entries.move_to_end(player_id)
+        while len(self._entries) > self.max_players:
+            self._entries.popitem(last=False)
+
+    @timed("maimai")
+    async def _fetch(self, player_id):
+        """请求上游；玩家不存在时返回错误结果（短时间缓存），网络错误或 5xx 返回 None（不缓存）"""
+        headers = {"Authorization": self.token} if self.token else {}
+        self.upstream_requests += 1
+        try:
+            resp = await self.pool.get(f"{self.base_url}/api/v0/maimai/player/{player_id}",
+                                       headers=headers, timeout=self.timeout)
+        except httpx.HTTPError as e:
+            self.upstream_errors += 1
+            logger.warning(f"⚠️ maimai API Error: {e}")
+            return None
+
+        if resp.status_code == 429:
+            self.upstream_errors += 1
+            self._paused_until = self._clock() + (parse_retry_after(resp) or self.refresh_interval)
+            return None
+        if resp.status_code in (400, 404):
+            return {"error": PLAYER_NOT_FOUND}
+        if resp.status_code != 200:
+            self.upstream_errors += 1
+            return None
+
+        data = resp.json()
+        # 查分器的响应包在 {"success", "code", "data"} 里
+        if isinstance(data.get("data"), dict):
+            data = data["data"]
+        return {
+            "player_id": data.get("player_id") or data.get("friend_code") or player_id,
+            "nickname": data.get("nickname") or data.get("name", ""),
+            "level": data.get("level") if data.get("level") is not None else data.get("rating", ""),
+        }
+
+    # === 后台批量刷新 ===
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _ensure_refresher(self):
+        if self._refresher is None and self.refresh_top > 0:
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+
+    def _due_for_refresh(self):
+        """最常被查询、缓存即将过期的玩家；查询计数每轮减半，热度随时间衰减"""
+        now = self._clock()
+        due = []
+        for player_id, _ in self._popularity.most_common(self.refresh_top):
+            entry = self._entries.get(player_id)
+            if entry is not None and "error" not in entry[0] and now - entry[1] >= self.ttl * 0.8:
+                due.append(player_id)
+        self._popularity = Counter({k: v // 2 for k, v in self._popularity.items() if v > 1})
+        return due
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                for player_id in self._due_for_refresh():
+                    while True:
+                        now = self._clock()
+                        if now < self._paused_until:
+                            await asyncio.sleep(self._paused_until - now)
+                        elif self._bucket.try_take(now):
+                            break
+                        else:
+                            await asyncio.sleep(1.0 / self._bucket.rate)
+                    if player_id not in self._inflight:
+                        await self._load(player_id)
+                        self.refreshed += 1
+            except Exception as e:
+                logger.warning(f"⚠️ maimai refresh failed: {e}")
+
+    async def aclose(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "upstream_requests": self.upstream_requests,
+            "upstream_errors": self.upstream_errors,
+            "refreshed": self.refreshed,
+        }
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest
+
+from response_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteMediaStore:
+    """本地 SQLite 存储，适合本地开发和单机部署；容器重启后本地文件会丢失"""
+
+    def __init__(self, path="media_cache.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def load(self):
+        with self._lock:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                "url TEXT PRIMARY KEY, file_id TEXT NOT NULL, file_size INTEGER, updated_at REAL)"
+            )
+            self._conn.commit()
+            rows = self._conn.execute("SELECT url, file_id, file_size FROM media").fetchall()
+        return {url: (file_id, file_size or 0) for url, file_id, file_size in rows}
+
+    def _execute(self, sql, params):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def put(self, url, file_id, file_size):
+        self._execute(
+            "INSERT OR REPLACE INTO media (url, file_id, file_size, updated_at) VALUES (?, ?, ?, ?)",
+            (url, file_id, file_size, time.time()),
+        )
+
+    def delete(self, url):
+        self._execute("DELETE FROM media WHERE url = ?", (url,))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class FirestoreMediaStore:
+    """
+    Firestore 存储（media_cache/{sha1(url)}），Cloud Run 多实例共享，实例重启后仍然保留。
+    URL 里有 "/"，不能直接作文档 ID，所以用哈希作 ID，原 URL 存在字段里。
+    """
+
+    def __init__(self, collection_ref):
+        self.collection = collection_ref
+
+    @staticmethod
+    def _doc_id(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def load(self):
+        entries = {}
+        for doc in self.collection.stream():
+            data = doc.to_dict() or {}
+            if data.get("url") and data.get("file_id"):
+                entries[data["url"]] = (data["file_id"], data.get("file_size") or 0)
+        return entries
+
+    def put(self, url, file_id, file_size):
+        self.collection.document(self._doc_id(url)).set(
+            {"url": url, "file_id": file_id, "file_size": file_size, "updated_at": time.time()}
+        )
+
+    def delete(self, url):
+        self.collection.document(self._doc_id(url)).delete()
+
+    def close(self):
+        pass
+
+
+class MediaFileCache:
+    """
+    VVQuest 图片 URL -> Telegram file_id 的缓存。
+    第一次用 URL 发送图片后记下 Telegram 返回的 file_id，之后直接发 file_id，Telegram 不用再下载图片。
+    持久化交给 store（SQLiteMediaStore / FirestoreMediaStore），启动时整表读入内存，查询不碰存储；
+    写入在单个后台线程里按顺序执行（同一 URL 先写后删不会颠倒）。
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-cache")
+        self._entries = {}          # url -> (file_id, file_size)
+        self._queries = Counter()   # 规范化后的消息 -> 触发表情包的次数，供预热使用
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.uploads = 0
+        self.invalidated = 0
+
+    @classmethod
+    def from_env(cls, firestore_db=None):
+        """
+        MEDIA_CACHE_BACKEND=firestore | sqlite；未设置时有 Firestore 就用 Firestore
+        （Cloud Run 本地磁盘随实例销毁），否则用 MEDIA_CACHE_PATH 指定的本地 SQLite 文件
+        """
+        backend = os.getenv("MEDIA_CACHE_BACKEND") or ("firestore" if firestore_db is not None else "sqlite")
+        if backend == "firestore":
+            if firestore_db is None:
+                raise ValueError("MEDIA_CACHE_BACKEND=firestore requires a Firestore client")
+            collection = os.getenv("MEDIA_CACHE_COLLECTION", "media_cache")
+            return cls(FirestoreMediaStore(firestore_db.collection(collection)))
+        if backend != "sqlite":
+            raise ValueError(f"Unknown MEDIA_CACHE_BACKEND: {backend}")
+        return cls(SQLiteMediaStore(os.getenv("MEDIA_CACHE_PATH", "media_cache.sqlite3")))
+
+    def load(self):
+        """从存储读入全部映射（阻塞，启动时在线程里调用）"""
+        self._entries = self.store.load()
+        return len(self._entries)
+
+    def _persist(self, func, *args):
+        self._executor.submit(func, *args).add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"⚠️ Media cache write failed: {future.exception()}")
+
+    # === 查询与记录 ===
+    def photo_for(self, url):
+        """发送时使用的 photo 参数：有 file_id 用 file_id，否则用原 URL"""
+        entry = self._entries.get(url)
+        if entry is None:
+            self.misses += 1
+            return url
+        self.hits += 1
+        self.bytes_saved += entry[1]
+        return entry[0]
+
+    def is_cached(self, url) -> bool:
+        return url in self._entries
+
+    def note_query(self, query, max_queries=10000):
+        self._queries[normalize_query(query)] += 1
+        if len(self._queries) > max_queries:
+            # 只保留较热门的一半，防止用户随手发的消息把计数表撑大
+            self._queries = Counter(dict(self._queries.most_common(max_queries // 2)))
+
+    def popular_queries(self, limit):
+        return [query for query, _ in self._queries.most_common(limit)]
+
+    def track(self, url, future):
+        """
+        挂在 send_photo 返回的 Future 上：用 URL 发送成功后记下 file_id；
+        用缓存的 file_id 发送失败（file_id 失效）时删掉这条映射，下次重新用 URL 上传。
+        """
+        def done(f):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                if url in self._entries and isinstance(f.exception(), BadRequest):
+                    self.forget(url)
+                return
+            if not getattr(f.result(), "photo", None) and url in self._entries:
+                # 发送队列在合并的图片发送失败后只补发了文字，说明缓存的 file_id 已不可用
+                self.forget(url)
+                return
+            self.remember(url, f.result())
+        future.add_done_callback(done)
+        return future
+
+    def remember(self, url, message):
+        sizes = getattr(message, "photo", None)
+        if not sizes or url in self._entries:
+            return
+        largest = sizes[-1]
+        file_size = largest.file_size or 0
+        self._entries[url] = (largest.file_id, file_size)
+        self.uploads += 1
+        self._persist(self.store.put, url, largest.file_id, file_size)
+
+    def forget(self, url):
+        if self._entries.pop(url, None) is not None:
+            self.invalidated += 1
+            self._persist(self.store.delete, url)
+
+    def close(self):
+        """等待排队的写入完成后关闭存储"""
+        self._executor.shutdown(wait=True)
+        self.store.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "uploads": self.uploads,
+            "invalidated": self.invalidated,
+        }
+
+
+class MediaCacheWarmer:
+    """
+    后台预热：每 interval 秒取最常触发表情包的 top 条查询，通过 fetch_urls(query) 取到图片 URL
+    （会顺带填充表情包查询缓存），把还没有 file_id 的图片先上传到 warm_chat_id（例如一个私有频道），
+    之后真正给用户发送时就直接命中 file_id。
+    """
+
+    def __init__(self, cache, fetch_urls, sender, warm_chat_id, interval=600.0, top=20):
+        self.cache = cache
+        self.fetch_urls = fetch_urls
+        self.sender = sender
+        self.warm_chat_id = warm_chat_id
+        self.interval = interval
+        self.top = top
+        self._task = None
+        self.warmed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def warm_once(self):
+        for query in self.cache.popular_queries(self.top):
+            for url in await self.fetch_urls(query):
+                if self.cache.is_cached(url):
+                    continue
+                try:
+                    message = await self.sender.send_photo(chat_id=self.warm_chat_id, photo=url)
+                except Exception as e:
+                    logger.warning(f"⚠️ Failed to warm media {url}: {e}")
+                    continue
+                self.cache.remember(url, message)
+                self.warmed += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.warm_once()
+            except Exception as e:
+                logger.warning(f"⚠️ Media cache warm-up failed: {e}")
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
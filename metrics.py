@@ -0,0 +1,223 @@
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 当前请求的 trace ID，写进结构化日志
+trace_id_var = contextvars.ContextVar("trace_id", default="-")
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value)}"'.replace("\n", "\\n") for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> dict:
+        """返回 {标签值元组: [各桶计数..., sum, count]} 的拷贝，两次快照相减即为区间内的分布"""
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames + ("le",), key + (repr(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                base = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{base} {series[-2]}")
+                lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+def bucket_quantile(buckets, series, q):
+    """
+    按 Prometheus histogram_quantile 的方式，从桶计数（非累积）线性插值估计分位数。
+    series 为 snapshot() 中的一项；落在 +Inf 桶里时返回最大的有限边界。
+    """
+    total = series[-1]
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(buckets, series):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return buckets[-1]
+
+
+class Registry:
+    """进程内的指标注册表，render() 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, stats_fn):
+        """把组件 stats() 字典里的数值导出为 gauge：chatbot_{prefix}_{key}"""
+        self._collectors.append((prefix, stats_fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Failed to collect {prefix} stats: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"chatbot_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("chatbot_stage_seconds", "Latency of each request stage in seconds", ("stage",))
+STAGE_ERRORS = REGISTRY.counter("chatbot_stage_errors_total", "Exceptions raised inside each stage", ("stage",))
+
+# span 结束时额外通知的回调 fn(stage, seconds)，例如流量采集（traffic_capture）
+_span_listeners = []
+
+
+def add_span_listener(fn):
+    _span_listeners.append(fn)
+
+
+def remove_span_listener(fn):
+    if fn in _span_listeners:
+        _span_listeners.remove(fn)
+
+
+@contextmanager
+def span(stage):
+    """计时一个处理阶段；异常照常抛出，同时计入错误数"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        for listener in _span_listeners:
+            listener(stage, elapsed)
+
+
+def timed(stage):
+    """协程函数装饰器版本的 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def new_trace_id(value=None) -> str:
+    trace_id = str(value) if value is not None else uuid.uuid4().hex[:16]
+    trace_id_var.set(trace_id)
+    return trace_id
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+def configure_logging(level=logging.INFO):
+    """
+    LOG_FORMAT=json 时输出 JSON 结构化日志（python-json-logger），否则沿用原来的文本格式；
+    两种格式都带上 trace_id。
+    """
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        try:
+            from pythonjsonlogger.json import JsonFormatter
+        except ImportError:
+            from pythonjsonlogger.jsonlogger import JsonFormatter
+        handler.setFormatter(JsonFormatter("%(asctime)s %(name)s %(levelname)s %(message)s %(trace_id)s"))
+    else:
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s"
+        ))
+    handler.addFilter(TraceIdFilter())
+    logging.basicConfig(level=level, handlers=[handler], force=True)
@@ -0,0 +1,286 @@
+"""
+离线重放采集到的线上流量（见 traffic_capture.py，TRAFFIC_CAPTURE_PATH 开启采集）。
+把日志里的对话消息按原始时间间隔（除以 --speed）送进 HKBU_ChatGPT.submit 完整流程，
+/maimai 查询送进 MaimaiClient；上游全部换成本地桩服务，桩服务的延迟从日志里采集到的
+上游耗时中抽样，内存版 Firestore 代替数据库。输出回复延迟分位数、各阶段耗时，可选 cProfile / 火焰图。
+
+    python replay_traffic.py capture.msgpack --speed 10
+    python replay_traffic.py capture.msgpack --speed 5 --profile replay.prof   # snakeviz replay.prof
+    python replay_traffic.py capture.msgpack --flamegraph replay.folded       # flamegraph.pl / speedscope
+
+用来在部署前比较缓存、批处理和并发参数的改动在真实流量形态下的效果。
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from bench_webhook import SEED_EVENTS, format_seconds, percentile, stage_breakdown
+from stub_server import StubMaimai, StubUpstream, StubVVQuest
+from traffic_capture import read_records
+
+# 桩服务 -> 用来抽样延迟的已采集阶段
+STUB_STAGES = {
+    "upstream": "completion",
+    "vvquest": "sticker",
+    "maimai": "maimai",
+}
+
+
+def load_capture(path, limit=None):
+    """返回 (按到达时间排序的 [(相对秒数, update)], {阶段: [耗时...]})"""
+    updates = []
+    timings = defaultdict(list)
+    for record in read_records(path):
+        if record.get("type") == "update":
+            updates.append((record["at"], record["update"]))
+        elif record.get("type") == "span":
+            timings[record["stage"]].append(record["seconds"])
+    updates.sort(key=lambda item: item[0])
+    if limit:
+        updates = updates[:limit]
+    start = updates[0][0] if updates else 0.0
+    return [(at - start, update) for at, update in updates], timings
+
+
+def classify(update):
+    """返回 (类型, user_id, 文本)；类型为 chat / maimai / skip"""
+    message = update.get("message") or {}
+    text = message.get("text")
+    user_id = (message.get("from") or {}).get("id")
+    if not text:
+        return "skip", user_id, text
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0].split("@", 1)[0]
+        return ("maimai" if command == "/maimai" and " " in text else "skip"), user_id, text
+    return "chat", user_id, text
+
+
+class StackSampler:
+    """
+    后台线程每 interval 秒采样一次目标线程（默认事件循环所在线程）的调用栈，
+    输出 Brendan Gregg 的折叠栈格式（"a;b;c 次数"），可直接交给 flamegraph.pl 或 speedscope。
+    比 cProfile 开销小，也能看到协程挂起前停在哪里。
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+async def replay(args, schedule, upstream, vvquest, maimai):
+    from ChatGPT_HKBU import HKBU_ChatGPT
+    from firestore_fake import FakeFirestore
+    from http_pool import HTTPPool
+    from maimai_client import MaimaiClient
+    from metrics import STAGE_SECONDS, new_trace_id
+
+    db = FakeFirestore()
+    for event in SEED_EVENTS:
+        db.collection("events").document().set(event)
+    chatgpt = HKBU_ChatGPT(
+        base_url=upstream.base_url,
+        model="stub-model",
+        api_version="2024-01-01",
+        access_token="stub",
+        firestore_db=db,
+        http_pool=HTTPPool(),
+    )
+    maimai_client = MaimaiClient(chatgpt.http_pool, maimai.base_url, refresh_top=0)
+    await chatgpt.warm_up()
+
+    latencies = defaultdict(list)   # 类型 -> [首条回复延迟]
+    followup_latencies = []
+    lag = []                        # 实际发出时间比计划晚了多少（重放机器跟不上时变大）
+    skipped = 0
+
+    async def handle(update_id, kind, user_id, text):
+        new_trace_id(update_id)
+        started = time.perf_counter()
+        if kind == "maimai":
+            await maimai_client.get_profile(text.split(maxsplit=1)[1])
+            latencies[kind].append(time.perf_counter() - started)
+            return
+        reply = await chatgpt.submit(text, user_id=user_id)
+        latencies[kind].append(time.perf_counter() - started)
+        followups = reply.get("followups") if isinstance(reply, dict) else None
+        if followups is not None:
+            await followups
+            followup_latencies.append(time.perf_counter() - started)
+
+    stages_before = STAGE_SECONDS.snapshot()
+    tasks = []
+    started = time.perf_counter()
+    for offset, update in schedule:
+        kind, user_id, text = classify(update)
+        if kind == "skip":
+            skipped += 1
+            continue
+        due = started + offset / args.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag.append(max(0.0, time.perf_counter() - due))
+        tasks.append(asyncio.ensure_future(handle(update.get("update_id"), kind, user_id, text)))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    errors = sum(isinstance(r, BaseException) for r in results)
+    stages = stage_breakdown(stages_before, STAGE_SECONDS.snapshot(), STAGE_SECONDS.buckets)
+
+    components = {
+        "upstream": chatgpt.upstream.stats(),
+        "session": chatgpt.memory.stats(),
+        "sticker_cache": chatgpt.sticker_cache.stats(),
+        "recommendation_cache": chatgpt.recommendation_cache.stats(),
+        "maimai": maimai_client.stats(),
+        "firestore": {"rpc_count": db.rpc_count, "batch_commits": db.batch_commits},
+    }
+    await maimai_client.aclose()
+    await chatgpt.aclose()
+
+    replayed = sum(len(samples) for samples in latencies.values())
+    return {
+        "updates": len(schedule),
+        "replayed": replayed,
+        "skipped": skipped,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": replayed / elapsed if elapsed else 0.0,
+        "schedule_lag_p95": percentile(lag, 0.95),
+        "reply_by_kind": {
+            kind: {
+                "count": len(samples),
+                "p50": percentile(samples, 0.50),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+            }
+            for kind, samples in latencies.items()
+        },
+        "followups_p50": percentile(followup_latencies, 0.50),
+        "followups_p95": percentile(followup_latencies, 0.95),
+        "stages": stages,
+        "components": components,
+    }
+
+
+def print_report(result):
+    print(f"\n📊 replayed {result['replayed']}/{result['updates']} updates ({result['skipped']} skipped, "
+          f"{result['errors']} errors) in {result['elapsed']:.1f}s ({result['throughput']:.2f} updates/s), "
+          f"schedule lag p95={format_seconds(result['schedule_lag_p95'])}")
+    print("  first reply:")
+    for kind, row in result["reply_by_kind"].items():
+        print(f"    {kind:<6} n={row['count']:<5} p50={format_seconds(row['p50'])} "
+              f"p95={format_seconds(row['p95'])} p99={format_seconds(row['p99'])}")
+    print(f"  followups    p50={format_seconds(result['followups_p50'])} p95={format_seconds(result['followups_p95'])}")
+    print("  stages (estimated from histogram buckets):")
+    for stage, row in sorted(result["stages"].items()):
+        print(f"    {stage:<16} n={row['count']:<5} mean={format_seconds(row['mean'])} "
+              f"p50={format_seconds(row['p50'])} p95={format_seconds(row['p95'])} p99={format_seconds(row['p99'])}")
+    print("  components:")
+    for name, stats in result["components"].items():
+        print(f"    {name}: {json.dumps(stats, ensure_ascii=False)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured webhook traffic through HKBU_ChatGPT against local stubs.")
+    parser.add_argument("capture", help="msgpack capture written by traffic_capture.TrafficRecorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded")
+    parser.add_argument("--limit", type=int, help="replay only the first N updates")
+    parser.add_argument("--recorded-latency", action=argparse.BooleanOptionalAction, default=True,
+                        help="draw stub latencies from the captured upstream timings")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="median LLM latency when not recorded (s)")
+    parser.add_argument("--llm-sigma", type=float, default=0.5)
+    parser.add_argument("--vvquest-latency", type=float, default=0.3)
+    parser.add_argument("--maimai-latency", type=float, default=0.2)
+    parser.add_argument("--profile", metavar="PATH", help="write cProfile stats to PATH")
+    parser.add_argument("--flamegraph", metavar="PATH", help="write sampled folded stacks to PATH")
+    parser.add_argument("--sample-interval", type=float, default=0.005, help="stack sampling interval (s)")
+    parser.add_argument("--output", help="write the full result as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    schedule, timings = load_capture(args.capture, args.limit)
+    if not schedule:
+        print(f"⚠️ No updates found in {args.capture}")
+        return 2
+
+    def samples(stub):
+        stage = STUB_STAGES[stub]
+        return timings.get(stage) if args.recorded_latency else None
+
+    upstream = StubUpstream(latency=args.llm_latency, sigma=args.llm_sigma, samples=samples("upstream"))
+    vvquest = StubVVQuest(latency=args.vvquest_latency, sigma=0.3, samples=samples("vvquest"))
+    maimai = StubMaimai(latency=args.maimai_latency, samples=samples("maimai"))
+    for name, stage in STUB_STAGES.items():
+        recorded = timings.get(stage)
+        source = f"{len(recorded)} recorded samples" if recorded and args.recorded_latency else "synthetic"
+        print(f"🧪 {name} stub latency: {source}")
+
+    profiler = cProfile.Profile() if args.profile else None
+    sampler = StackSampler(args.sample_interval) if args.flamegraph else None
+    with upstream, vvquest, maimai:
+        os.environ["VVQUEST_URL"] = vvquest.base_url
+        if sampler is not None:
+            sampler.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = asyncio.run(replay(args, schedule, upstream, vvquest, maimai))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("profile", "flamegraph", "output")}
+    print_report(result)
+
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        print(f"💾 cProfile stats written to {args.profile}")
+    if sampler is not None:
+        sampler.write(args.flamegraph)
+        print(f"💾 Folded stacks ({sum(sampler.stacks.values())} samples) written to {args.flamegraph}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
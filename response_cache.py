@@ -0,0 +1,88 @@
+import asyncio
+import re
+import unicodedata
+
+from cachetools import TTLCache
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text) -> str:
+    """缓存键规范化：全角转半角、大小写折叠、合并空白"""
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class AsyncResponseCache:
+    """
+    异步调用结果缓存：容量受限的 LRU + 每条 TTL。
+    - 空结果（is_negative 为真）单独用较短的 negative_ttl 缓存，避免反复查询没有结果的词
+    - should_cache 为假的结果（例如错误提示）不缓存
+    - 相同键的并发请求共用一次正在进行的调用
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=600.0, negative_ttl=60.0,
+                 is_negative=lambda value: not value, should_cache=lambda value: True):
+        self.name = name
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._negative = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self._inflight = {}
+        self._is_negative = is_negative
+        self._should_cache = should_cache
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_load(self, key, loader):
+        """命中缓存直接返回，否则调用 loader()（协程函数）并缓存结果"""
+        if key in self._cache:
+            self.hits += 1
+            return self._cache[key]
+        if key in self._negative:
+            self.negative_hits += 1
+            return self._negative[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.ensure_future(loader())
+        self._inflight[key] = future
+        # 在 loader 完成时缓存结果：等待方超时被取消（例如 collect_followups）后结果照样留给下次使用
+        future.add_done_callback(lambda f: self._store(key, f))
+        return await asyncio.shield(future)
+
+    def _store(self, key, future):
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        value = future.result()
+        if self._should_cache(value):
+            if self._is_negative(value):
+                self._negative[key] = value
+            else:
+                self._cache[key] = value
+
+    def clear(self):
+        self._cache.clear()
+        self._negative.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.negative_hits + self.misses + self.coalesced
+        return (self.hits + self.negative_hits + self.coalesced) / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "negative_size": len(self._negative),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hit_rate,
+        }
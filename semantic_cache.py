@@ -0,0 +1,134 @@
+import math
+import re
+import time
+from collections import OrderedDict, defaultdict
+
+from response_cache import normalize_query
+
+# 标点、空白和表情不参与相似度计算
+_NON_WORD_RE = re.compile(r"[\W_]+")
+# 句末语气词不改变意思：「你是谁啊」和「你是谁」视为同一个问题
+_TRAILING_PARTICLES_RE = re.compile(r"[啊呀吧呢嘛哦啦呗哈]+$")
+# 否定词：只差一个「不」的两句话字符相似度很高，意思却相反
+_NEGATIONS = frozenset("不没别非无未莫")
+
+
+def _canonical(text):
+    return _TRAILING_PARTICLES_RE.sub("", _NON_WORD_RE.sub("", normalize_query(text)))
+
+
+def negations(text):
+    """问题里出现的否定词（有序元组，含重复），否定词不一致的问题不互相命中"""
+    return tuple(sorted(ch for ch in _canonical(text) if ch in _NEGATIONS))
+
+
+def embed(text, ngram_sizes=(1, 2, 3), dims=1 << 18):
+    """
+    轻量本地向量：字符 n-gram 哈希到 dims 个桶，L2 归一化后以稀疏 dict 表示。
+    中文短句按字符 n-gram 也能很好地反映措辞上的相似度。
+    """
+    text = _canonical(text)
+    if not text:
+        return {}
+    padded = f"^{text}$"
+    counts = defaultdict(float)
+    for n in ngram_sizes:
+        for i in range(max(1, len(padded) - n + 1)):
+            counts[hash(padded[i:i + n]) % dims] += 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {bucket: v / norm for bucket, v in counts.items()}
+
+
+class _Entry:
+    __slots__ = ("question", "answer", "vector", "negations", "created", "hits")
+
+    def __init__(self, question, answer, vector, created):
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.negations = negations(question)
+        self.created = created
+        self.hits = 0
+
+
+class SemanticCache:
+    """
+    语义缓存：问题向量与已缓存问题的余弦相似度不低于 threshold 且否定词一致时直接复用答案。
+    字符 n-gram 只反映措辞，换一个词（今天/明天、音乐会/读书会）相似度仍有 0.7~0.8，
+    所以默认阈值很高，实际只命中去掉标点和句末语气词后几乎相同的问题。
+    用桶 -> 条目的倒排表只比较共享 n-gram 的候选，容量和 TTL 有上限，按 LRU 淘汰。
+    """
+
+    def __init__(self, threshold=0.9, capacity=512, ttl=3600.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()       # entry_id -> _Entry
+        self._postings = defaultdict(set)   # bucket -> {entry_id}
+        self._next_id = 0
+
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for bucket in entry.vector:
+            postings = self._postings.get(bucket)
+            if postings is not None:
+                postings.discard(entry_id)
+                if not postings:
+                    del self._postings[bucket]
+
+    def lookup(self, question):
+        """返回 (answer, similarity)；未命中返回 None"""
+        self.lookups += 1
+        vector = embed(question)
+        if not vector:
+            return None
+        scores = defaultdict(float)
+        for bucket, weight in vector.items():
+            for entry_id in self._postings.get(bucket, ()):
+                scores[entry_id] += weight * self._entries[entry_id].vector[bucket]
+        if not scores:
+            return None
+
+        entry_id, similarity = max(scores.items(), key=lambda item: item[1])
+        if similarity < self.threshold or self._entries[entry_id].negations != negations(question):
+            return None
+        entry = self._entries[entry_id]
+        if self._clock() - entry.created > self.ttl:
+            self._remove(entry_id)
+            return None
+        entry.hits += 1
+        self.hits += 1
+        self._entries.move_to_end(entry_id)
+        return entry.answer, similarity
+
+    def store(self, question, answer):
+        vector = embed(question)
+        if not vector:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _Entry(question, answer, vector, self._clock())
+        for bucket in vector:
+            self._postings[bucket].add(entry_id)
+        while len(self._entries) > self.capacity:
+            self._remove(next(iter(self._entries)))
+
+    def top_entries(self, limit=10):
+        """命中次数最多的条目，便于观察哪些问题最常被复用"""
+        entries = sorted(self._entries.values(), key=lambda e: e.hits, reverse=True)[:limit]
+        return [{"question": e.question, "hits": e.hits} for e in entries]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+        }
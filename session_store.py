@@ -0,0 +1,266 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+
+import msgpack
+
+from context_window import HistoryWindow, estimate_tokens
+
+
+class Role(IntEnum):
+    """消息角色用小整数保存，比每条消息一个 dict 省内存"""
+    SYSTEM = 0
+    USER = 1
+    ASSISTANT = 2
+
+    @classmethod
+    def parse(cls, value):
+        if isinstance(value, cls):
+            return value
+        return cls[str(value).upper()]
+
+
+# 每条消息除正文外的大致开销（tuple + enum 引用 + deque 槽位）
+_MESSAGE_OVERHEAD = 72
+_SESSION_OVERHEAD = 256
+
+
+class _Session:
+    __slots__ = ("messages", "last_access", "nbytes", "seq", "summary")
+
+    def __init__(self, max_messages, now):
+        self.messages = deque(maxlen=max_messages)  # (Role, content, tokens)
+        self.last_access = now
+        self.nbytes = _SESSION_OVERHEAD
+        self.seq = 0            # 已追加消息的总数，用于标记摘要覆盖到哪里
+        self.summary = None     # (covered_seq, text)
+
+
+class LRUSessionStore:
+    """
+    按用户保存最近几条对话的会话缓存。
+    - LRU：超过 max_users 或 max_bytes 时淘汰最久未访问的用户
+    - 空闲 TTL：超过 idle_ttl 秒未访问的用户会被清掉
+    - 可选共享后端（如 Redis），多个实例之间共用热数据，避免每个实例都去查 Firestore
+    - prefer_shared=True 时以共享后端为准（多工作进程部署：同一用户的消息可能落到不同进程，
+      本地缓存会过期），每次先读共享后端，内容没变时保留本地会话（包括摘要）
+    """
+
+    def __init__(self, max_messages=20, max_users=10000, idle_ttl=3600.0, max_bytes=64 * 1024 * 1024,
+                 shared=None, prefer_shared=False, clock=time.monotonic):
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.prefer_shared = prefer_shared and shared is not None
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_env(cls):
+        # 只配置了 SHARED_REDIS_URL 时会话也放在同一个 Redis 里，多工作进程部署只需一个地址
+        redis_url = os.getenv("SESSION_REDIS_URL") or os.getenv("SHARED_REDIS_URL")
+        multi_worker = int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+        return cls(
+            max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "20")),
+            max_users=int(os.getenv("SESSION_MAX_USERS", "10000")),
+            idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "3600")),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+            shared=RedisSessionBackend(redis_url) if redis_url else None,
+            prefer_shared=os.getenv("SESSION_PREFER_SHARED", "1" if multi_worker else "0") == "1",
+        )
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return self._lookup(user_id, count=False) is not None
+
+    @staticmethod
+    def _message_size(content):
+        return sys.getsizeof(content) + _MESSAGE_OVERHEAD
+
+    def _lookup(self, user_id, count=True):
+        session = self._sessions.get(user_id)
+        now = self._clock()
+        if session is not None and now - session.last_access > self.idle_ttl:
+            self._drop(user_id)
+            self.expirations += 1
+            session = None
+        if session is None:
+            if count:
+                self.misses += 1
+            return None
+        if count:
+            self.hits += 1
+        session.last_access = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def _drop(self, user_id):
+        session = self._sessions.pop(user_id)
+        self._nbytes -= session.nbytes
+
+    def _evict(self):
+        now = self._clock()
+        # OrderedDict 按访问时间排序，队首就是最久未访问的用户
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access > self.idle_ttl:
+                self._drop(user_id)
+                self.expirations += 1
+            elif len(self._sessions) > self.max_users or self._nbytes > self.max_bytes:
+                self._drop(user_id)
+                self.evictions += 1
+            else:
+                break
+
+    def get(self, user_id):
+        """返回 [{"role": ..., "content": ...}, ...]；未缓存时返回 None"""
+        with self._lock:
+            session = self._lookup(user_id)
+            if session is None:
+                return None
+            return [{"role": role.name.lower(), "content": content} for role, content, _ in session.messages]
+
+    def window(self, user_id):
+        """返回带 token 数的历史快照（HistoryWindow），供 ContextBuilder 按预算裁剪"""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return HistoryWindow([], 0, None)
+            items = list(session.messages)
+            return HistoryWindow(items, session.seq - len(items), session.summary)
+
+    def set_summary(self, user_id, covered_seq, text):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return
+            if session.summary is not None:
+                _, old = session.summary
+                session.nbytes -= sys.getsizeof(old)
+                self._nbytes -= sys.getsizeof(old)
+            session.summary = (covered_seq, text)
+            session.nbytes += sys.getsizeof(text)
+            self._nbytes += sys.getsizeof(text)
+
+    def put(self, user_id, messages):
+        """用一组历史消息（dict 列表）初始化用户会话"""
+        with self._lock:
+            if user_id in self._sessions:
+                self._drop(user_id)
+            session = _Session(self.max_messages, self._clock())
+            self._sessions[user_id] = session
+            self._nbytes += session.nbytes
+            for msg in messages:
+                self._append_locked(session, Role.parse(msg["role"]), msg["content"])
+            self._evict()
+
+    def append(self, user_id, role, content):
+        with self._lock:
+            session = self._lookup(user_id, count=False)
+            if session is None:
+                session = _Session(self.max_messages, self._clock())
+                self._sessions[user_id] = session
+                self._nbytes += session.nbytes
+            self._append_locked(session, Role.parse(role), content)
+            self._evict()
+
+    def _append_locked(self, session, role, content):
+        if len(session.messages) == session.messages.maxlen:
+            _, old, _ = session.messages[0]
+            freed = self._message_size(old)
+            session.nbytes -= freed
+            self._nbytes -= freed
+        # token 数在写入时算一次，之后组装上下文不再重复计算
+        session.messages.append((role, content, estimate_tokens(content)))
+        session.seq += 1
+        size = self._message_size(content)
+        session.nbytes += size
+        self._nbytes += size
+
+    def _snapshot(self, user_id):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            return [(int(role), content) for role, content, _ in session.messages]
+
+    # === 共享后端 ===
+    async def fetch_shared(self, user_id):
+        """本地未命中时从共享后端取历史，取到则写入本地缓存"""
+        if self.shared is None:
+            return None
+        try:
+            packed = await asyncio.to_thread(self.shared.get, user_id)
+        except Exception as e:
+            print(f"⚠️ 共享会话读取失败: {e}")
+            return None
+        if packed is None:
+            return None
+        local = self._snapshot(user_id)
+        if local is not None and [tuple(m) for m in packed] == local:
+            return self.get(user_id)
+        messages = [{"role": Role(role).name.lower(), "content": content} for role, content in packed]
+        self.put(user_id, messages)
+        return messages
+
+    async def publish(self, user_id):
+        """把本地最新的会话写回共享后端"""
+        if self.shared is None:
+            return
+        snapshot = self._snapshot(user_id)
+        if snapshot is None:
+            return
+        try:
+            await asyncio.to_thread(self.shared.set, user_id, snapshot)
+        except Exception as e:
+            print(f"⚠️ 共享会话写入失败: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._sessions),
+            "bytes": self._nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RedisSessionBackend:
+    """
+    Redis 共享会话后端，用 msgpack 紧凑存储 [[role, content], ...]。
+    redis 为可选依赖，只有配置了 SESSION_REDIS_URL / SHARED_REDIS_URL 才会用到（镜像里已安装）。
+    """
+
+    def __init__(self, url, ttl=3600, prefix="session:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("使用共享会话后端需要安装 redis：pip install redis") from e
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get(self, user_id):
+        raw = self._redis.get(f"{self.prefix}{user_id}")
+        if raw is None:
+            return None
+        return msgpack.unpackb(raw)
+
+    def set(self, user_id, messages):
+        self._redis.set(f"{self.prefix}{user_id}", msgpack.packb(messages), ex=self.ttl)
@@ -0,0 +1,103 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+
+class ShardedCounter:
+    """
+    分片计数器 + 进程内聚合，用于 keyword_counts。
+    每个关键词的计数分散在 keyword_counts/{keyword}/shards/{0..N-1} 上，避开 Firestore
+    单文档约每秒 1 次写入的限制；进程内先累加增量，每 flush_interval 秒批量写一次随机分片。
+    读路径直接返回本地已知的计数，不会在每次写入后再读一遍文档。
+    """
+
+    def __init__(self, db, collection="keyword_counts", num_shards=10, flush_interval=1.0, refresh_interval=300.0):
+        self.db = db
+        self.collection = collection
+        self.num_shards = num_shards
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+
+        self._known = {}                  # keyword -> 本地已知的总数（含未写入的增量）
+        self._loaded_at = {}              # keyword -> 上次从 Firestore 读取总数的时间
+        self._loading = {}                # keyword -> 正在读取的 Future，避免并发重复读取
+        self._pending = defaultdict(int)  # keyword -> 尚未写入 Firestore 的增量
+        self._task = None
+
+    def _doc_ref(self, keyword):
+        return self.db.collection(self.collection).document(keyword)
+
+    def _load_total(self, keyword):
+        doc_ref = self._doc_ref(keyword)
+        # 兼容分片之前直接写在关键词文档上的 count
+        legacy = doc_ref.get()
+        total = (legacy.to_dict() or {}).get("count", 0) if legacy.exists else 0
+        for shard in doc_ref.collection("shards").stream():
+            total += (shard.to_dict() or {}).get("count", 0)
+        return total
+
+    async def _ensure_loaded(self, keyword):
+        loaded_at = self._loaded_at.get(keyword)
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return
+        future = self._loading.get(keyword)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self._load_total, keyword))
+            self._loading[keyword] = future
+            try:
+                remote = await future
+            finally:
+                self._loading.pop(keyword, None)
+            # 远端总数 + 本地还没写出去的增量
+            self._known[keyword] = remote + self._pending.get(keyword, 0)
+            self._loaded_at[keyword] = time.monotonic()
+        else:
+            await future
+
+    async def increment(self, keyword, amount=1) -> int:
+        """累加计数并返回本地已知的最新总数"""
+        await self._ensure_loaded(keyword)
+        self._known[keyword] = self._known.get(keyword, 0) + amount
+        self._pending[keyword] += amount
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return self._known[keyword]
+
+    async def get(self, keyword) -> int:
+        await self._ensure_loaded(keyword)
+        return self._known.get(keyword, 0)
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """把累积的增量写到随机分片上"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(int)
+        try:
+            await asyncio.to_thread(self._commit, pending)
+        except Exception as e:
+            print(f"⚠️ 关键词计数写入失败，稍后重试: {e}")
+            for keyword, delta in pending.items():
+                self._pending[keyword] += delta
+
+    def _commit(self, pending):
+        from google.cloud import firestore  # 延迟导入，不拖慢冷启动
+
+        items = list(pending.items())
+        # Firestore 单个 batch 最多 500 个写操作
+        for start in range(0, len(items), 500):
+            batch = self.db.batch()
+            for keyword, delta in items[start:start + 500]:
+                shard_ref = self._doc_ref(keyword).collection("shards").document(str(random.randrange(self.num_shards)))
+                batch.set(shard_ref, {"count": firestore.Increment(delta)}, merge=True)
+            batch.commit()
+
+    async def aclose(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        await self.flush()
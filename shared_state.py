@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# 原子地补充并取走令牌：KEYS[1]=桶，ARGV=rate, capacity, now, ttl
+_TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return allowed
+"""
+
+
+def shared_redis_url():
+    """多进程共享状态使用的 Redis；未配置 SHARED_REDIS_URL 时沿用会话缓存的 SESSION_REDIS_URL"""
+    return os.getenv("SHARED_REDIS_URL") or os.getenv("SESSION_REDIS_URL")
+
+
+def _connect(url):
+    try:
+        import redis
+    except ImportError as e:
+        raise ImportError("多进程共享状态需要安装 redis：pip install redis") from e
+    return redis.Redis.from_url(url)
+
+
+class RedisUpdateDedupe:
+    """
+    跨工作进程的 update_id 去重：SET NX 抢占，抢到的进程负责处理。
+    Telegram 重发的更新可能落到另一个工作进程上，进程内的去重表发现不了。
+    """
+
+    def __init__(self, url, ttl=3600, prefix="update:"):
+        self._redis = _connect(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.claimed = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls):
+        url = shared_redis_url()
+        return cls(url) if url else None
+
+    async def claim(self, update_id) -> bool:
+        """首次见到该更新时返回 True；Redis 不可用时放行，交给进程内去重兜底"""
+        try:
+            claimed = await asyncio.to_thread(
+                self._redis.set, f"{self.prefix}{update_id}", 1, nx=True, ex=self.ttl
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ Shared dedupe unavailable: {e}")
+            return True
+        if claimed:
+            self.claimed += 1
+            return True
+        self.duplicates += 1
+        return False
+
+    async def release(self, update_id):
+        """入队失败（如返回 503）时释放，让 Telegram 重发的同一更新还能被处理"""
+        try:
+            await asyncio.to_thread(self._redis.delete, f"{self.prefix}{update_id}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ Failed to release update {update_id}: {e}")
+
+    def stats(self) -> dict:
+        return {"claimed": self.claimed, "duplicates": self.duplicates, "errors": self.errors}
+
+
+class RedisRateLimiter:
+    """跨工作进程共享的每用户令牌桶，语义与 admission.TokenBucket 相同"""
+
+    def __init__(self, url, prefix="ratelimit:", clock=time.time):
+        self._redis = _connect(url)
+        self._script = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        self.prefix = prefix
+        self._clock = clock
+
+    @classmethod
+    def from_env(cls):
+        url = shared_redis_url()
+        return cls(url) if url else None
+
+    async def try_take(self, user_id, rate, capacity) -> bool:
+        # 桶在补满所需时间之后就没有意义了，过期删除
+        ttl = max(1, int(capacity / rate) + 1) if rate > 0 else 3600
+        allowed = await asyncio.to_thread(
+            self._script, keys=[f"{self.prefix}{user_id}"], args=[rate, capacity, self._clock(), ttl]
+        )
+        return bool(allowed)
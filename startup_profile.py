@@ -0,0 +1,116 @@
+import builtins
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def process_uptime():
+    """当前进程已运行的秒数（读取 /proc，非 Linux 环境返回 None），用来把解释器启动时间也算进冷启动"""
+    try:
+        with open("/proc/self/stat") as f:
+            # comm 字段可能含空格，从最后一个 ')' 之后开始数；starttime 是其后的第 20 个字段
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfiler:
+    """
+    记录冷启动各阶段的耗时：解释器启动、模块导入、Firestore / Telegram / 连接池初始化……
+    STARTUP_PROFILE_IMPORTS=1 时还会统计每个顶层包的导入耗时（包含其依赖），找出拖慢启动的模块。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.interpreter_seconds = process_uptime()
+        self.phases = {}
+        self.import_seconds = {}
+        self.ready_seconds = None
+        self._original_import = None
+        self._import_depth = 0
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if self._import_depth or level or name in sys.modules:
+            self._import_depth += 1
+            try:
+                return self._original_import(name, globals, locals, fromlist, level)
+            finally:
+                self._import_depth -= 1
+        started = time.perf_counter()
+        self._import_depth += 1
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._import_depth -= 1
+            package = name.split(".", 1)[0]
+            self.import_seconds[package] = self.import_seconds.get(package, 0.0) + time.perf_counter() - started
+
+    @contextmanager
+    def imports(self, name="imports"):
+        """计时一段 import 语句；开启 STARTUP_PROFILE_IMPORTS 时按顶层包拆分"""
+        profile = os.getenv("STARTUP_PROFILE_IMPORTS", "0") == "1"
+        if profile:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+        try:
+            with self.phase(name):
+                yield
+        finally:
+            if profile:
+                builtins.__import__ = self._original_import
+
+    def mark_ready(self):
+        if self.ready_seconds is None:
+            self.ready_seconds = time.perf_counter() - self.started
+            self.log_report()
+
+    @property
+    def cold_start_seconds(self):
+        """从进程启动（拿不到时从本模块导入）到就绪的总耗时"""
+        if self.ready_seconds is None:
+            return None
+        return self.ready_seconds + (self.interpreter_seconds or 0.0)
+
+    def report(self) -> dict:
+        slowest = sorted(self.import_seconds.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            "ready": self.ready_seconds is not None,
+            "interpreter_seconds": self.interpreter_seconds,
+            "ready_seconds": self.ready_seconds,
+            "cold_start_seconds": self.cold_start_seconds,
+            "phases": dict(self.phases),
+            "slowest_imports": dict(slowest),
+        }
+
+    def log_report(self):
+        phases = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        logger.info(f"🚀 Cold start {self.cold_start_seconds or 0.0:.2f}s ({phases})")
+        for package, seconds in self.report()["slowest_imports"].items():
+            logger.info(f"   import {package}: {seconds * 1000:.0f}ms")
+
+    def stats(self) -> dict:
+        stats = {"ready": int(self.ready_seconds is not None)}
+        if self.cold_start_seconds is not None:
+            stats["cold_start_seconds"] = self.cold_start_seconds
+        for name, seconds in self.phases.items():
+            stats[f"{name.replace('-', '_')}_seconds"] = seconds
+        return stats
+
+
+# 进程内唯一的启动记录，尽早导入以便从头计时
+STARTUP = StartupProfiler()
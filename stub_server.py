@@ -0,0 +1,238 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubServer:
+    """
+    本地 HTTP 桩服务的基类，在后台线程里运行。
+    延迟模型：sigma > 0 时按中位数为 latency 的对数正态分布取值（更接近真实上游的长尾），
+    否则为 latency + 0~jitter 秒的均匀抖动；给定 samples（例如采集到的线上上游耗时）时从中随机抽取。
+    error_rate 控制注入错误的比例。
+    延迟和错误注入都从 seed 初始化的独立随机数生成器取值，同一个 seed 的压测可重复。
+    子类实现 respond(method, path, query, body)，返回 (status, headers, payload)，
+    payload 为 bytes，或分段发送的 bytes 列表（chunked，用于 SSE）。
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.05, jitter=0.0, sigma=0.0, error_rate=0.0, error_status=503, retry_after=None,
+                 samples=None, seed=None, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.sigma = sigma
+        self.samples = list(samples) if samples else None
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def delay(self):
+        if self.samples:
+            return self.rng.choice(self.samples)
+        if self.sigma > 0:
+            return self.latency * self.rng.lognormvariate(0, self.sigma)
+        return self.latency + self.rng.uniform(0, self.jitter)
+
+    def injected_error(self):
+        """按 error_rate 注入错误；返回错误响应或 None"""
+        if self.rng.random() >= self.error_rate:
+            return None
+        with self._lock:
+            self.errors += 1
+        headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+        return self.error_status, headers, b'{"error": "injected failure"}'
+
+    def respond(self, method, path, query, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def json_response(payload, status=200):
+        return status, {}, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if "application/x-www-form-urlencoded" in content_type:
+                    body = {k: v[0] for k, v in parse_qs(raw.decode("utf-8")).items()}
+                else:
+                    try:
+                        body = json.loads(raw) if raw else {}
+                    except ValueError:
+                        body = {}
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(stub.delay())
+
+                status, headers, payload = stub.injected_error() or stub.respond(self.command, parts.path, query, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if isinstance(payload, list):
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for part in payload:
+                        self.wfile.write(f"{len(part):x}\r\n".encode() + part + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    if "Content-Type" not in headers:
+                        self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class StubUpstream(StubServer):
+    """
+    模拟 HKBU chat-completions / completions 上游。
+    请求体里 "stream": true 时按 SSE 格式分段返回。
+    用法：
+        with StubUpstream(latency=0.2, error_rate=0.1) as stub:
+            client = HKBU_ChatGPT(base_url=stub.base_url, ...)
+    """
+
+    name = "stub-upstream"
+
+    def __init__(self, reply="哼，才不是特意回答你的呢！", **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+
+    def respond(self, method, path, query, body):
+        if "completions" not in path:
+            return self.json_response({"error": "not found"}, status=404)
+        if "chat/completions" not in path:
+            return self.json_response({"choices": [{"text": "音乐会\n桌游之夜\n读书会"}]})
+        if body.get("stream"):
+            chunks = [self.reply[i:i + 4] for i in range(0, len(self.reply), 4)]
+            events = [
+                f"data: {json.dumps({'choices': [{'delta': {'content': chunk}}]}, ensure_ascii=False)}\n\n".encode("utf-8")
+                for chunk in chunks
+            ]
+            return 200, {"Content-Type": "text/event-stream"}, events + [b"data: [DONE]\n\n"]
+        return self.json_response({"choices": [{"message": {"role": "assistant", "content": self.reply}}]})
+
+
+class StubVVQuest(StubServer):
+    """模拟 VVQuest 表情包搜索；empty_rate 比例的查询返回空结果"""
+
+    name = "stub-vvquest"
+
+    def __init__(self, empty_rate=0.3, **kwargs):
+        super().__init__(**kwargs)
+        self.empty_rate = empty_rate
+
+    def respond(self, method, path, query, body):
+        if self.rng.random() < self.empty_rate:
+            return self.json_response({"code": 200, "data": []})
+        n = int(query.get("n", 1))
+        return self.json_response({"code": 200, "data": [f"{self.base_url}/img/{i}.png" for i in range(n)]})
+
+
+class StubMaimai(StubServer):
+    """模拟舞萌 DX 查分器的玩家资料接口"""
+
+    name = "stub-maimai"
+
+    def respond(self, method, path, query, body):
+        return self.json_response({"player_id": "stub", "nickname": "ＳＴＵＢ", "level": 13})
+
+
+class StubTelegram(StubServer):
+    """
+    模拟 Telegram Bot API（/bot<token>/<method>）。
+    把 sendMessage / sendPhoto / editMessageText 按时间顺序记录到 sent 列表里，
+    on_send(chat_id, method, text) 回调供压测脚本统计回复延迟。
+    """
+
+    name = "stub-telegram"
+
+    def __init__(self, on_send=None, **kwargs):
+        kwargs.setdefault("latency", 0.0)
+        super().__init__(**kwargs)
+        self.on_send = on_send
+        self.sent = []
+        self._message_id = 0
+
+    def respond(self, method, path, query, body):
+        api_method = path.rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            return self.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot",
+            }})
+        if api_method in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(body.get("chat_id", 0))
+            text = body.get("text", "")
+            with self._lock:
+                self._message_id += 1
+                message_id = int(body.get("message_id") or self._message_id)
+                self.sent.append((time.perf_counter(), chat_id, api_method, text))
+            if self.on_send is not None:
+                self.on_send(chat_id, api_method, text)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+            if api_method == "sendPhoto":
+                # 用 URL 发送时分配一个 file_id，再次用 file_id 发送时原样返回
+                photo = str(body.get("photo", ""))
+                file_id = photo if photo.startswith("stub-file-") else f"stub-file-{abs(hash(photo)):x}"
+                result["photo"] = [{
+                    "file_id": file_id, "file_unique_id": file_id[-12:], "width": 512, "height": 512,
+                    "file_size": 48 * 1024,
+                }]
+                result.pop("text")
+                if body.get("caption"):
+                    result["caption"] = body["caption"]
+            return self.json_response({"ok": True, "result": result})
+        # setWebhook、deleteWebhook 等其他方法一律成功
+        return self.json_response({"ok": True, "result": True})
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+
+from admission import TokenBucket
+from metrics import REGISTRY
+from telegram_stream import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = REGISTRY.histogram(
+    "chatbot_telegram_send_seconds", "Time from enqueue to delivery of outbound Telegram calls", ("method",)
+)
+
+# 图片说明文字最多 1024 个字符，更长的文本不能合并进图片
+CAPTION_LIMIT = 1024
+
+
+class _Job:
+    __slots__ = ("method", "kwargs", "merge_key", "futures", "enqueued", "attempts", "fallback")
+
+    def __init__(self, method, kwargs, merge_key, future, now):
+        self.method = method
+        self.kwargs = kwargs
+        self.merge_key = merge_key
+        self.futures = [future]
+        self.enqueued = now
+        self.attempts = 0
+        self.fallback = None    # 合并发送失败时单独补发的文本
+
+
+class TelegramOutbox:
+    """
+    Telegram 发送队列，按官方限流规则调度所有外发消息：
+    - 全局令牌桶：约每秒 30 条
+    - 每个聊天一个令牌桶：私聊约每秒 1 条（允许少量突发），群组每分钟 20 条
+    - 同一聊天的消息严格按顺序逐条发送；不同聊天之间轮转，一个刷屏的聊天不会饿死其他聊天
+    - RetryAfter 时暂停该聊天到指定时间后自动重试，最多 max_retries 次
+    - 排队中的相邻消息尽量合并：同一条消息的多次编辑只发最后一次；
+      文本 + 图片只有在调用方给了相同的 merge_key 时才合并成带说明的图片（例如同一条回复的表情包和推荐），
+      不相关的消息（如 /help 的回复）不会变成别人图片的说明
+    send_message / send_photo / edit_message_text 与 Bot 的同名方法参数一致，可以直接替代 bot 使用；
+    它们立即入队并返回 Future，连续调用几次再一起 await 才能触发合并。
+    """
+
+    def __init__(self, bot, global_rate=30.0, per_chat_rate=1.0, per_chat_burst=3, group_rate=20 / 60,
+                 max_retries=3, max_chats=10000, merge=True, clock=time.monotonic):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.merge = merge
+        self._clock = clock
+
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._buckets = OrderedDict()   # chat_id -> TokenBucket
+        self._queues = OrderedDict()    # chat_id -> deque[_Job]，按轮转顺序排列
+        self._busy = set()              # 正在发送的聊天
+        self._paused_until = {}         # chat_id -> 时间（RetryAfter）
+        self._wakeup = None
+        self._task = None
+        self._deliveries = set()
+
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    # === 入队 ===
+    def send_message(self, chat_id, text, merge_key=None, **kwargs):
+        return self._enqueue("send_message", dict(chat_id=chat_id, text=text, **kwargs), merge_key)
+
+    def send_photo(self, chat_id, photo, merge_key=None, **kwargs):
+        return self._enqueue("send_photo", dict(chat_id=chat_id, photo=photo, **kwargs), merge_key)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._enqueue("edit_message_text", dict(chat_id=chat_id, message_id=message_id, text=text, **kwargs))
+
+    def _enqueue(self, method, kwargs, merge_key=None) -> asyncio.Future:
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        chat_id = kwargs["chat_id"]
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        job = _Job(method, kwargs, merge_key, future, self._clock())
+        if not (self.merge and queue and self._try_merge(queue[-1], job)):
+            queue.append(job)
+        self._wakeup.set()
+        return future
+
+    @staticmethod
+    def _plain_text(job):
+        return (job.method == "send_message" and set(job.kwargs) == {"chat_id", "text"}
+                and len(job.kwargs["text"]) <= CAPTION_LIMIT)
+
+    def _try_merge(self, queued, job) -> bool:
+        """把 job 合并进还在排队的 queued；成功时 job 的 Future 跟随 queued 的结果"""
+        if queued.method == "edit_message_text" and job.method == "edit_message_text" \
+                and queued.kwargs["message_id"] == job.kwargs["message_id"]:
+            queued.kwargs = job.kwargs
+        elif queued.merge_key is None or queued.merge_key != job.merge_key:
+            return False
+        elif queued.method == "send_photo" and "caption" not in queued.kwargs and self._plain_text(job):
+            queued.kwargs["caption"] = job.kwargs["text"]
+            queued.fallback = job.kwargs
+        elif self._plain_text(queued) and job.method == "send_photo" and "caption" not in job.kwargs:
+            queued.fallback = queued.kwargs
+            queued.method = "send_photo"
+            queued.kwargs = dict(job.kwargs, caption=queued.kwargs["text"])
+        else:
+            return False
+        queued.futures.extend(job.futures)
+        self.merged += 1
+        return True
+
+    # === 调度 ===
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    @staticmethod
+    def _is_group(chat_id):
+        """群组和频道的 chat_id 为负数；"@username" 形式的 chat_id 只能是公开频道"""
+        try:
+            return int(chat_id) < 0
+        except (TypeError, ValueError):
+            return True
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if self._is_group(chat_id) else self.per_chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.per_chat_burst, now)
+            while len(self._buckets) > self.max_chats:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    @staticmethod
+    def _wait_for_token(bucket, now):
+        """距离桶里攒够一个令牌还要多久（不消耗令牌）"""
+        tokens = min(bucket.capacity, bucket.tokens + (now - bucket.updated) * bucket.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / bucket.rate
+
+    async def _run(self):
+        while True:
+            try:
+                wait = self._dispatch_ready()
+            except Exception as e:
+                # 调度出错也不能让发送队列停下来，稍后重试
+                logger.error(f"❌ Telegram outbox scheduling failed: {e}")
+                wait = 1.0
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch_ready(self):
+        """把可以发送的聊天各取一条开始发送，返回距离下一条可发送还要等多久（None 表示等待新消息）"""
+        self._wakeup.clear()
+        wait = None
+        for chat_id in list(self._queues):
+            queue = self._queues[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+                continue
+            if chat_id in self._busy:
+                continue
+            now = self._clock()
+            delay = max(self._paused_until.get(chat_id, 0.0) - now,
+                        self._wait_for_token(self._bucket(chat_id, now), now),
+                        self._wait_for_token(self._global, now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            self._bucket(chat_id, now).try_take(now)
+            self._global.try_take(now)
+            self._paused_until.pop(chat_id, None)
+            self._busy.add(chat_id)
+            self._queues.move_to_end(chat_id)
+            task = asyncio.ensure_future(self._deliver(chat_id, queue.popleft()))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        return wait
+
+    async def _deliver(self, chat_id, job):
+        try:
+            result = await getattr(self.bot, job.method)(**job.kwargs)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            self._paused_until[chat_id] = self._clock() + delay
+            if job.attempts < self.max_retries:
+                job.attempts += 1
+                self.retried += 1
+                logger.warning(f"⚠️ Telegram flood limit for chat {chat_id}, retrying in {delay:.1f}s")
+                self._requeue(chat_id, job)
+            else:
+                self._fail(job, e)
+        except Exception as e:
+            if job.fallback is not None:
+                # 合并后的图片发送失败（例如图片地址失效），至少把文本单独发出去
+                job.method, job.kwargs, job.fallback = "send_message", job.fallback, None
+                self._requeue(chat_id, job)
+            else:
+                self._fail(job, e)
+        else:
+            self.sent += 1
+            SEND_SECONDS.observe(self._clock() - job.enqueued, method=job.method)
+            for future in job.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            self._wakeup.set()
+
+    def _requeue(self, chat_id, job):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.appendleft(job)
+
+    def _fail(self, job, error):
+        self.failed += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def aclose(self, timeout=10.0):
+        """尽量发完排队中的消息（最多等 timeout 秒）后停止调度"""
+        deadline = self._clock() + timeout
+        while (self.depth or self._busy) and self._clock() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "chats_waiting": len(self._queues),
+            "in_flight": len(self._busy),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+# Telegram 单条消息最多 4096 个字符
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def retry_after_seconds(error) -> float:
+    """RetryAfter.retry_after 在不同版本的 python-telegram-bot 中可能是 int 或 timedelta"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class StreamingMessageSender:
+    """
+    把流式生成的文本推送到 Telegram：
+    收到第一段文字时先发一条消息，之后按节流间隔编辑这条消息，
+    超过单条长度上限时换一条新消息继续。
+    编辑频率受 min_interval（秒）和 min_chars（新增字符数）共同限制，避免触发 Telegram 的编辑频率限制。
+    """
+
+    def __init__(self, bot, chat_id, min_interval=1.5, min_chars=24):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self._text = ""
+        self._sent_text = ""
+        self._message = None
+        self._next_edit_at = 0.0
+
+    async def push(self, delta):
+        self._text += delta
+        while len(self._text) > TELEGRAM_MESSAGE_LIMIT:
+            # 当前消息写满：定稿后用剩余部分开一条新消息
+            head, self._text = self._text[:TELEGRAM_MESSAGE_LIMIT], self._text[TELEGRAM_MESSAGE_LIMIT:]
+            if self._message is None:
+                await self.bot.send_message(chat_id=self.chat_id, text=head)
+            else:
+                await self._flush(head, force=True)
+            self._message = None
+            self._sent_text = ""
+
+        if self._message is None:
+            if self._text.strip():
+                await self._send_first()
+            return
+        if time.monotonic() >= self._next_edit_at and len(self._text) - len(self._sent_text) >= self.min_chars:
+            await self._flush(self._text)
+
+    async def finish(self, text=None):
+        """流结束时做最后一次编辑；text 用于替换成完整文本（例如出错时的提示）"""
+        if text is not None and not self._sent_text and self._message is None:
+            self._text = text
+        if self._message is None:
+            if self._text.strip():
+                await self._send_first()
+            return
+        if self._text != self._sent_text:
+            wait = self._next_edit_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._flush(self._text, force=True)
+
+    @property
+    def started(self):
+        return self._message is not None
+
+    async def _send_first(self):
+        self._message = await self.bot.send_message(chat_id=self.chat_id, text=self._text)
+        self._sent_text = self._text
+        self._next_edit_at = time.monotonic() + self.min_interval
+
+    async def _flush(self, text, force=False):
+        while True:
+            try:
+                # 通过 bot 编辑（而不是 Message.edit_text），bot 可以是 TelegramOutbox，编辑同样受发送队列调度
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self._message.message_id)
+                self._sent_text = text
+                break
+            except RetryAfter as e:
+                if not force:
+                    # 被限流时推迟下次编辑，继续接收后续内容
+                    self._next_edit_at = time.monotonic() + retry_after_seconds(e)
+                    return
+                await asyncio.sleep(retry_after_seconds(e))
+            except BadRequest as e:
+                # 内容没有变化时 Telegram 会报错，忽略即可
+                if "not modified" not in str(e).lower():
+                    raise
+                break
+        self._next_edit_at = time.monotonic() + self.min_interval
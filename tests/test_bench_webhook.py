@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from bench_webhook import ReplyTracker, stub_seed
+from stub_server import StubVVQuest
+
+
+def test_same_seed_reproduces_stub_draws():
+    def draws(seed):
+        with StubVVQuest(latency=0.1, sigma=0.5, error_rate=0.3,
+                         seed=stub_seed(SimpleNamespace(seed=seed), "vvquest")) as stub:
+            return [(stub.delay(), stub.injected_error() is None) for _ in range(20)]
+
+    assert draws(7) == draws(7)
+    assert draws(7) != draws(8)
+
+
+def test_admission_replies_are_not_counted_as_chat():
+    tracker = ReplyTracker()
+    tracker.rejection_texts = {"太快了"}
+    tracker.expect(1, "chat", 0.0)
+    tracker.expect(1, "chat", 0.0)
+    tracker.on_send(1, "sendMessage", "太快了")
+    tracker.on_send(1, "sendMessage", "正常回复")
+
+    assert len(tracker.rejected) == 1
+    assert len(tracker.latencies["chat"]) == 1
+    assert tracker.outstanding == 0
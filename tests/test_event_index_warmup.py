@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+import ChatGPT_HKBU
+from ChatGPT_HKBU import HKBU_ChatGPT
+from event_index import EventKeywordIndex
+from firestore_fake import FakeFirestore
+
+
+def make_client(db):
+    return HKBU_ChatGPT(base_url="http://127.0.0.1:9", model="stub", api_version="v", access_token="t",
+                        firestore_db=db)
+
+
+def seeded_db():
+    db = FakeFirestore()
+    db.collection("events").document().set({"title": "周末音乐会", "keywords": ["音乐会", "周末"]})
+    return db
+
+
+def test_concurrent_warm_up_attaches_one_listener(monkeypatch):
+    attached = []
+
+    class SlowIndex(EventKeywordIndex):
+        def attach(self, collection_ref, poll_interval=60.0):
+            attached.append(self)
+            time.sleep(0.05)
+            super().attach(collection_ref, poll_interval)
+
+    monkeypatch.setattr(ChatGPT_HKBU, "EventKeywordIndex", SlowIndex)
+    client = make_client(seeded_db())
+    threads = [threading.Thread(target=client._warm_event_index) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(attached) == 1
+    assert client.event_index is attached[0]
+    assert client.event_index.ready.is_set()
+
+
+def test_message_path_does_not_wait_for_index():
+    async def run():
+        client = make_client(seeded_db())
+        asked = []
+
+        async def fake_ask(prompt):
+            asked.append(prompt)
+            return ["LLM 推荐"]
+
+        client.ask_chatgpt_for_recommendations = fake_ask
+        # 还没有预热：不建索引、不等待，直接由 ChatGPT 生成推荐
+        started = time.monotonic()
+        cold = await client.generate_dynamic_recommendations("周末有什么音乐会")
+        cold_seconds = time.monotonic() - started
+        created = client.event_index is not None
+
+        assert (await client.warm_up())["event_index"]
+        warm = await client.generate_dynamic_recommendations("周末有什么音乐会")
+        await client.aclose()
+        return cold, cold_seconds, created, warm, asked
+
+    cold, cold_seconds, created, warm, asked = asyncio.run(run())
+    assert cold == ["LLM 推荐"]
+    assert cold_seconds < 1
+    assert not created
+    assert [event["title"] for event in warm] == ["周末音乐会"]
+    assert len(asked) == 1
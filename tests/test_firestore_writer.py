@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+from firestore_fake import FakeFirestore, FakeWriteBatch
+from firestore_writer import FirestoreWriteBehind
+from metrics import new_trace_id
+
+
+class FlakyFirestore(FakeFirestore):
+    """前 failures 次 batch 提交抛出异常（failures=None 表示一直失败）"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    def batch(self):
+        db = self
+
+        class FlakyBatch(FakeWriteBatch):
+            def commit(self):
+                db.attempts += 1
+                if db.failures is None or db.attempts <= db.failures:
+                    raise RuntimeError("deadline exceeded")
+                return super().commit()
+
+        return FlakyBatch(self)
+
+
+def write_two(db, **kwargs):
+    async def run():
+        writer = FirestoreWriteBehind(db, flush_interval=0.01, base_backoff=0.001, **kwargs)
+        for user_id in ("u1", "u2"):
+            new_trace_id(f"trace-{user_id}")
+            assert writer.enqueue(db.collection("sessions").document(user_id), {"turns": 1}, merge=True)
+        await writer.aclose()
+        return writer.stats()
+
+    return asyncio.run(run())
+
+
+def test_commit_is_retried_until_it_succeeds(caplog):
+    db = FlakyFirestore(failures=2)
+    with caplog.at_level(logging.WARNING, logger="firestore_writer"):
+        stats = write_two(db)
+
+    assert stats["retries"] == 2
+    assert stats["written"] == 2
+    assert stats["failed"] == 0
+    assert db.collection("sessions").document("u1").get().to_dict() == {"turns": 1}
+    warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 2
+    assert "trace-u1,trace-u2" in warnings[0].getMessage()
+
+
+def test_batch_is_dropped_and_logged_after_max_retries(caplog):
+    db = FlakyFirestore(failures=None)
+    with caplog.at_level(logging.WARNING, logger="firestore_writer"):
+        stats = write_two(db, max_retries=2)
+
+    assert db.attempts == 3
+    assert stats["retries"] == 2
+    assert stats["failed"] == 2
+    assert stats["written"] == 0
+    assert not db.collection("sessions").document("u1").get().exists
+    errors = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert len(errors) == 1
+    assert "放弃 2 条" in errors[0].getMessage()
+
+
+def test_full_queue_drops_and_logs(caplog):
+    async def run():
+        db = FakeFirestore()
+        writer = FirestoreWriteBehind(db, max_queue=1, flush_interval=0.01)
+        accepted = [writer.enqueue(db.collection("sessions").document(f"u{i}"), {"turns": 1}) for i in range(3)]
+        await writer.aclose()
+        return accepted, writer.stats()
+
+    with caplog.at_level(logging.ERROR, logger="firestore_writer"):
+        accepted, stats = asyncio.run(run())
+
+    assert accepted == [True, False, False]
+    assert stats["dropped"] == 2
+    assert stats["written"] == 1
+    assert sum("队列已满" in r.getMessage() for r in caplog.records) == 2
@@ -0,0 +1,97 @@
+import asyncio
+
+from ChatGPT_HKBU import HKBU_ChatGPT
+from firestore_fake import FakeFirestore
+from session_store import Role
+
+
+def make_client(db):
+    return HKBU_ChatGPT(base_url="http://127.0.0.1:9", model="stub", api_version="v", access_token="t",
+                        firestore_db=db)
+
+
+async def turn(client, user_id, message, reply):
+    await client._load_history(user_id)
+    client.memory.append(user_id, Role.USER, message)
+    client.memory.append(user_id, Role.ASSISTANT, reply)
+    client._persist_turn(user_id, message, reply)
+    while client.writer.written < client.writer.enqueued:
+        await asyncio.sleep(0.01)
+
+
+def contents(history):
+    return [msg["content"] for msg in history]
+
+
+def test_stale_local_session_does_not_hide_turns_written_elsewhere():
+    async def run():
+        db = FakeFirestore()
+        worker_a, worker_b = make_client(db), make_client(db)
+        await turn(worker_a, "u1", "q1", "a1")
+        await turn(worker_b, "u1", "q2", "a2")
+        # worker_a 的本地会话里没有 q2/a2
+        await turn(worker_a, "u1", "q3", "a3")
+        return await make_client(db)._load_history("u1")
+
+    assert contents(asyncio.run(run())) == ["q1", "a1", "q2", "a2", "q3", "a3"]
+
+
+def test_fresh_instance_repairs_stale_tail_after_fallback():
+    async def run():
+        db = FakeFirestore()
+        worker_a, worker_b = make_client(db), make_client(db)
+        await turn(worker_a, "u1", "q1", "a1")
+        await turn(worker_b, "u1", "q2", "a2")
+        await turn(worker_a, "u1", "q3", "a3")
+        stale = db.collection("chat_history").document("u1").get().to_dict()
+        # 新实例读到过期的尾部文档，回退到 messages 查询，写入时要把尾部文档修好
+        await turn(make_client(db), "u1", "q4", "a4")
+        repaired = db.collection("chat_history").document("u1").get().to_dict()
+        return stale, repaired
+
+    stale, repaired = asyncio.run(run())
+    assert stale["tail_count"] != stale["message_count"]
+    assert repaired["tail_count"] == repaired["message_count"] == 8
+    assert [msg["content"] for msg in repaired["tail"]][-2:] == ["q4", "a4"]
+
+
+def test_tail_is_served_when_current():
+    async def run():
+        db = FakeFirestore()
+        worker = make_client(db)
+        await turn(worker, "u1", "q1", "a1")
+        await turn(worker, "u1", "q2", "a2")
+        reader = make_client(db)
+        tail = db.collection("chat_history").document("u1").get().to_dict()
+        return await reader._load_history("u1"), tail
+
+    history, tail = asyncio.run(run())
+    assert contents(history) == ["q1", "a1", "q2", "a2"]
+    assert tail["tail_count"] == tail["message_count"] == 4
+
+
+def test_failed_load_does_not_overwrite_tail():
+    async def run():
+        db = FakeFirestore()
+        await turn(make_client(db), "u1", "q1", "a1")
+
+        broken = make_client(db)
+        original = broken.load_history_from_firestore
+        broken.load_history_from_firestore = lambda *a, **k: (_ for _ in ()).throw(RuntimeError("unavailable"))
+        await turn(broken, "u1", "q2", "a2")
+        broken.load_history_from_firestore = original
+        return await make_client(db)._load_history("u1")
+
+    assert contents(asyncio.run(run())) == ["q1", "a1", "q2", "a2"]
+
+
+def test_failed_prefetch_still_marks_sessions_done():
+    db = FakeFirestore()
+    client = make_client(db)
+    # 查询 chat_history 时出错
+    client.firestore_db = type("Broken", (), {"collection": lambda self, name: 1 / 0})()
+    try:
+        client.prefetch_recent_sessions()
+    except ZeroDivisionError:
+        pass
+    assert client.sessions_prefetched.is_set()
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from http_pool import HTTPPool
+from maimai_client import INVALID_PLAYER_ID, PROFILE_UNAVAILABLE, MaimaiClient
+from stub_server import StubMaimai
+
+
+def test_coalesced_callers_share_fallback_on_upstream_error():
+    async def run(base_url):
+        pool = HTTPPool()
+        client = MaimaiClient(pool, base_url, refresh_top=0)
+        try:
+            return await asyncio.gather(*(client.get_profile("12345") for _ in range(3))), client
+        finally:
+            await client.aclose()
+            await pool.aclose()
+
+    with StubMaimai(latency=0.05, error_rate=1.0) as stub:
+        profiles, client = asyncio.run(run(stub.base_url))
+
+    assert profiles == [{"error": PROFILE_UNAVAILABLE}] * 3
+    assert client.coalesced == 2
+    assert stub.requests == 1
+
+
+@pytest.mark.parametrize("player_id", ["../../user/maimai/player", "1?x=1", "12345/../67890", "１２３"])
+def test_non_friend_code_ids_never_reach_upstream(player_id):
+    async def run(base_url):
+        pool = HTTPPool()
+        client = MaimaiClient(pool, base_url, token="developer-token", refresh_top=0)
+        try:
+            return await client.get_profile(player_id), client
+        finally:
+            await client.aclose()
+            await pool.aclose()
+
+    with StubMaimai(latency=0) as stub:
+        profile, client = asyncio.run(run(stub.base_url))
+
+    assert profile == {"error": INVALID_PLAYER_ID}
+    assert stub.requests == 0
+    assert client.stats()["size"] == 0
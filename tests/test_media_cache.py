@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import pytest
+
+from firestore_fake import FakeFirestore
+from media_cache import FirestoreMediaStore, MediaFileCache, SQLiteMediaStore
+
+
+def sent_photo(file_id, file_size=1024):
+    return SimpleNamespace(photo=[SimpleNamespace(file_id=file_id, file_size=file_size)])
+
+
+@pytest.fixture(params=["sqlite", "firestore"])
+def make_store(request, tmp_path):
+    db = FakeFirestore()
+    if request.param == "sqlite":
+        return lambda: SQLiteMediaStore(str(tmp_path / "media.sqlite3"))
+    return lambda: FirestoreMediaStore(db.collection("media_cache"))
+
+
+def test_file_ids_survive_restart(make_store):
+    cache = MediaFileCache(make_store())
+    cache.load()
+    cache.remember("https://img/1.png", sent_photo("file-1"))
+    cache.remember("https://img/2.png", sent_photo("file-2"))
+    cache.forget("https://img/2.png")
+    cache.close()
+
+    restarted = MediaFileCache(make_store())
+    assert restarted.load() == 1
+    assert restarted.photo_for("https://img/1.png") == "file-1"
+    assert restarted.photo_for("https://img/2.png") == "https://img/2.png"
+
+
+def test_from_env_prefers_firestore_when_available(monkeypatch):
+    monkeypatch.delenv("MEDIA_CACHE_BACKEND", raising=False)
+    assert isinstance(MediaFileCache.from_env(FakeFirestore()).store, FirestoreMediaStore)
+    assert isinstance(MediaFileCache.from_env(None).store, SQLiteMediaStore)
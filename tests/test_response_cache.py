@@ -0,0 +1,45 @@
+import asyncio
+
+from response_cache import AsyncResponseCache
+
+
+def test_result_is_cached_when_waiters_are_cancelled():
+    cache = AsyncResponseCache("test")
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["value"]
+
+    async def run():
+        for _ in range(3):
+            try:
+                await asyncio.wait_for(cache.get_or_load("k", loader), timeout=0.01)
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.sleep(0.1)
+        return await cache.get_or_load("k", loader)
+
+    assert asyncio.run(run()) == ["value"]
+    assert len(calls) == 1
+    assert cache.stats()["size"] == 1
+
+
+def test_failed_load_is_not_cached():
+    cache = AsyncResponseCache("test")
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def ok():
+        return ["value"]
+
+    async def run():
+        try:
+            await cache.get_or_load("k", failing)
+        except RuntimeError:
+            pass
+        return await cache.get_or_load("k", ok)
+
+    assert asyncio.run(run()) == ["value"]
@@ -0,0 +1,37 @@
+import pytest
+
+from semantic_cache import SemanticCache
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("我喜欢你", "我不喜欢你"),
+    ("我很喜欢这首歌", "我不太喜欢这首歌"),
+    ("今天天气怎么样", "明天天气怎么样"),
+    ("推荐一下周末的音乐会", "推荐一下周末的读书会"),
+])
+def test_negation_and_different_entity_do_not_hit(cached, asked):
+    cache = SemanticCache()
+    cache.store(cached, "answer")
+    assert cache.lookup(asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("你是谁", "你是谁？"),
+    ("你是谁", "你是谁啊"),
+    ("今天天气怎么样", "今天天气怎么样呀"),
+    ("你叫什么名字", "你叫 什么名字！"),
+])
+def test_near_identical_questions_hit(cached, asked):
+    cache = SemanticCache()
+    cache.store(cached, "answer")
+    hit = cache.lookup(asked)
+    assert hit is not None and hit[0] == "answer"
+
+
+def test_expired_entry_is_dropped():
+    now = [0.0]
+    cache = SemanticCache(ttl=10, clock=lambda: now[0])
+    cache.store("你是谁", "answer")
+    now[0] = 11
+    assert cache.lookup("你是谁") is None
+    assert len(cache) == 0
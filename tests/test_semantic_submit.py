@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+from ChatGPT_HKBU import HKBU_ChatGPT
+from semantic_cache import SemanticCache
+
+
+class FakeUpstream:
+    """回答取决于对话历史：知道名字时说出名字"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def post(self, url, json=None, headers=None):
+        self.calls += 1
+        said = " ".join(m["content"] for m in json["messages"] if m["role"] == "user")
+        if "我叫小明" in said and "名字" in json["messages"][-1]["content"]:
+            content = "你叫小明"
+        elif "名字" in said:
+            content = "我不知道你的名字"
+        else:
+            content = "你好呀"
+        return SimpleNamespace(status_code=200, json=lambda: {"choices": [{"message": {"content": content}}]})
+
+
+def make_client():
+    client = HKBU_ChatGPT(base_url="http://127.0.0.1:9", model="stub", api_version="v", access_token="t",
+                          semantic_cache=SemanticCache())
+    client.upstream = FakeUpstream()
+
+    async def no_followups(message):
+        return {}
+
+    client.collect_followups = no_followups
+    return client
+
+
+def test_history_dependent_answer_is_not_served_to_other_users():
+    async def run():
+        client = make_client()
+        await client.submit("我叫小明", user_id="alice")
+        alice = await client.submit("我叫什么名字？", user_id="alice")
+        bob = await client.submit("我叫什么名字？", user_id="bob")
+        await client.aclose()
+        return alice["text"], bob["text"]
+
+    assert asyncio.run(run()) == ("你叫小明", "我不知道你的名字")
+
+
+def test_first_turn_answer_is_shared():
+    async def run():
+        client = make_client()
+        first = await client.submit("你好", user_id="alice")
+        second = await client.submit("你好", user_id="bob")
+        calls = client.upstream.calls
+        await client.aclose()
+        return first["text"], second["text"], calls
+
+    assert asyncio.run(run()) == ("你好呀", "你好呀", 1)
@@ -0,0 +1,43 @@
+import asyncio
+
+from ChatGPT_HKBU import HKBU_ChatGPT
+from http_pool import HTTPPool
+from stub_server import StubVVQuest
+
+
+def fetch_twice(stub, between=None):
+    async def run():
+        client = HKBU_ChatGPT(base_url="http://127.0.0.1:9", model="stub", api_version="v", access_token="t",
+                              http_pool=HTTPPool())
+        client.vvquest_url = stub.base_url
+        first = await client.try_fetch_vvquest_image("早上好")
+        if between is not None:
+            between()
+        second = await client.try_fetch_vvquest_image("早上好")
+        stats = client.sticker_cache.stats()
+        await client.aclose()
+        return first, second, stats
+
+    return asyncio.run(run())
+
+
+def test_upstream_error_is_not_negative_cached():
+    with StubVVQuest(latency=0, empty_rate=0, error_rate=1.0) as stub:
+        def recover():
+            stub.error_rate = 0.0
+
+        first, second, stats = fetch_twice(stub, between=recover)
+
+    assert first == []
+    assert second == [f"{stub.base_url}/img/0.png"]
+    assert stub.requests == 2
+    assert stats["negative_size"] == 0
+
+
+def test_empty_result_is_negative_cached():
+    with StubVVQuest(latency=0, empty_rate=1.0) as stub:
+        first, second, stats = fetch_twice(stub)
+
+    assert first == second == []
+    assert stub.requests == 1
+    assert stats["negative_hits"] == 1
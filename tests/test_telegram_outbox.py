@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram_outbox import TelegramOutbox
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def send_message(self, **kwargs):
+        self.calls.append(("send_message", kwargs))
+        return SimpleNamespace(message_id=len(self.calls))
+
+    async def send_photo(self, **kwargs):
+        self.calls.append(("send_photo", kwargs))
+        return SimpleNamespace(message_id=len(self.calls))
+
+
+def make_outbox(bot):
+    return TelegramOutbox(bot, global_rate=1000.0, per_chat_rate=1000.0, group_rate=1000.0)
+
+
+def test_unrelated_text_is_not_merged_into_queued_photo():
+    async def run():
+        bot = FakeBot()
+        outbox = make_outbox(bot)
+        # 第一条占住聊天，后面两条都在排队
+        first = outbox.send_message(1, "hi")
+        photo = outbox.send_photo(1, "https://example.com/a.png", merge_key="reply-1")
+        help_text = outbox.send_message(1, "/help 的回复")
+        await asyncio.gather(first, photo, help_text)
+        await outbox.aclose()
+        return bot.calls, outbox.merged
+
+    calls, merged = asyncio.run(run())
+    assert merged == 0
+    assert [method for method, _ in calls] == ["send_message", "send_photo", "send_message"]
+    assert "caption" not in calls[1][1]
+
+
+def test_jobs_with_same_merge_key_become_captioned_photo():
+    async def run():
+        bot = FakeBot()
+        outbox = make_outbox(bot)
+        first = outbox.send_message(1, "hi")
+        photo = outbox.send_photo(1, "https://example.com/a.png", merge_key="reply-1")
+        text = outbox.send_message(1, "推荐活动", merge_key="reply-1")
+        await asyncio.gather(first, photo, text)
+        await outbox.aclose()
+        return bot.calls, outbox.merged
+
+    calls, merged = asyncio.run(run())
+    assert merged == 1
+    assert calls[1] == ("send_photo", {"chat_id": 1, "photo": "https://example.com/a.png", "caption": "推荐活动"})
+    assert len(calls) == 2
+
+
+def test_string_chat_id_uses_group_rate_and_is_delivered():
+    async def run():
+        bot = FakeBot()
+        outbox = TelegramOutbox(bot, global_rate=1000.0, per_chat_rate=1000.0, group_rate=500.0)
+        await asyncio.wait_for(outbox.send_message("@channel", "公告"), timeout=1)
+        rate = outbox._buckets["@channel"].rate
+        await outbox.aclose()
+        return bot.calls, rate
+
+    calls, rate = asyncio.run(run())
+    assert calls == [("send_message", {"chat_id": "@channel", "text": "公告"})]
+    assert rate == 500.0
+
+
+def test_scheduler_survives_errors():
+    async def run():
+        bot = FakeBot()
+        outbox = make_outbox(bot)
+        bucket = outbox._bucket
+        failures = []
+
+        def flaky_bucket(chat_id, now):
+            if not failures:
+                failures.append(chat_id)
+                raise RuntimeError("boom")
+            return bucket(chat_id, now)
+
+        outbox._bucket = flaky_bucket
+        await asyncio.wait_for(outbox.send_message(1, "hi"), timeout=3)
+        running = not outbox._task.done()
+        await outbox.aclose()
+        return bot.calls, failures, running
+
+    calls, failures, running = asyncio.run(run())
+    assert failures == [1]
+    assert running
+    assert calls == [("send_message", {"chat_id": 1, "text": "hi"})]
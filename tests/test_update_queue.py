@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+from update_queue import ACCEPTED, DUPLICATE, UpdateDispatcher
+
+
+def make_update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id))
+
+
+def test_same_chat_is_processed_in_order():
+    async def run():
+        seen = []
+
+        async def process(update):
+            await asyncio.sleep(0.01 * (3 - update.update_id))
+            seen.append(update.update_id)
+
+        dispatcher = UpdateDispatcher(process, num_workers=4)
+        for update_id in range(3):
+            assert dispatcher.submit(make_update(update_id, chat_id=7)) == ACCEPTED
+        assert dispatcher.submit(make_update(0, chat_id=7)) == DUPLICATE
+        await dispatcher.aclose()
+        return seen
+
+    assert asyncio.run(run()) == [0, 1, 2]
+
+
+def test_hung_update_only_blocks_its_shard_for_max_block():
+    async def run():
+        done = {}
+        release = asyncio.Event()
+
+        async def process(update):
+            if update.update_id == 1:
+                await release.wait()
+            done[update.update_id] = asyncio.get_running_loop().time()
+
+        dispatcher = UpdateDispatcher(process, num_workers=1, max_block=0.05)
+        started = asyncio.get_running_loop().time()
+        dispatcher.submit(make_update(1, chat_id=1))
+        dispatcher.submit(make_update(2, chat_id=2))
+        await asyncio.sleep(0.2)
+        unrelated_latency = done[2] - started
+        release.set()
+        await dispatcher.aclose()
+        return unrelated_latency, dispatcher.stats(), done
+
+    unrelated_latency, stats, done = asyncio.run(run())
+    assert unrelated_latency < 0.15
+    assert stats["detached"] == 1
+    assert set(done) == {1, 2}
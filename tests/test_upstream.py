@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from http_pool import HTTPPool
+from stub_server import StubServer
+from upstream import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ResilientClient, UpstreamUnavailable
+
+
+class ScriptedStub(StubServer):
+    """按到达顺序依次使用 script 里的 (延迟, 状态码, 响应头)，用完后一直返回最后一项"""
+
+    name = "stub-scripted"
+
+    def __init__(self, script, **kwargs):
+        super().__init__(latency=0.0, **kwargs)
+        self.script = list(script)
+        self._local = threading.local()
+        self._next = 0
+
+    def delay(self):
+        with self._lock:
+            step = self.script[min(self._next, len(self.script) - 1)]
+            self._next += 1
+        self._local.step = step
+        return step[0]
+
+    def respond(self, method, path, query, body):
+        _, status, headers = self._local.step
+        return status, headers, b'{"ok": true}'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(stub, scenario, **client_kwargs):
+    async def main():
+        pool = HTTPPool()
+        client_kwargs.setdefault("base_backoff", 0.01)
+        client = ResilientClient(pool, **client_kwargs)
+        try:
+            return await scenario(client, f"{stub.base_url}/chat")
+        finally:
+            await pool.aclose()
+
+    with stub:
+        return asyncio.run(main())
+
+
+def test_retries_5xx_until_success():
+    stub = ScriptedStub([(0, 503, {}), (0, 502, {}), (0, 200, {})])
+
+    async def scenario(client, url):
+        response = await client.post(url, json={})
+        return response.status_code, client.retries, client.breaker.state
+
+    assert run(stub, scenario, max_retries=2) == (200, 2, CLOSED)
+    assert stub.requests == 3
+
+
+def test_gives_up_after_max_retries_and_returns_last_response():
+    stub = ScriptedStub([(0, 503, {})])
+
+    async def scenario(client, url):
+        return (await client.post(url, json={})).status_code, client.breaker.failures
+
+    assert run(stub, scenario, max_retries=1) == (503, 1)
+    assert stub.requests == 2
+
+
+def test_honours_retry_after():
+    stub = ScriptedStub([(0, 429, {"Retry-After": "0.3"}), (0, 200, {})])
+
+    async def scenario(client, url):
+        started = time.monotonic()
+        response = await client.post(url, json={})
+        return response.status_code, time.monotonic() - started
+
+    status, elapsed = run(stub, scenario, max_retries=1)
+    assert status == 200
+    assert elapsed >= 0.3
+
+
+def test_hedged_request_wins_when_primary_is_slow():
+    # 前 3 个请求用来积累延迟样本，第 4 个（主请求）很慢，第 5 个（对冲请求）很快
+    stub = ScriptedStub([(0, 200, {})] * 3 + [(1.0, 200, {}), (0, 200, {})])
+
+    async def scenario(client, url):
+        for _ in range(3):
+            await client.post(url, json={})
+        started = time.monotonic()
+        response = await client.post(url, json={})
+        return response.status_code, time.monotonic() - started, client.hedged, client.hedge_wins
+
+    status, elapsed, hedged, wins = run(stub, scenario, hedge=True, hedge_min_samples=3, hedge_min_delay=0.1)
+    assert status == 200
+    assert elapsed < 0.8
+    assert (hedged, wins) == (1, 1)
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    stub = ScriptedStub([(0, 503, {}), (0, 503, {}), (0, 200, {})])
+
+    async def scenario(client, url):
+        states = []
+        for _ in range(2):
+            await client.post(url, json={})
+        states.append(breaker.state)
+        with pytest.raises(UpstreamUnavailable):
+            await client.post(url, json={})
+        clock.now += 10
+        probe = asyncio.ensure_future(client.post(url, json={}))
+        await asyncio.sleep(0)
+        states.append(breaker.state)
+        # 探测进行中时其他请求仍被拒绝
+        with pytest.raises(UpstreamUnavailable):
+            await client.post(url, json={})
+        response = await probe
+        states.append(breaker.state)
+        return states, response.status_code
+
+    states, status = run(stub, scenario, max_retries=0, breaker=breaker)
+    assert states == [OPEN, HALF_OPEN, CLOSED]
+    assert status == 200
+
+
+def test_cancelled_half_open_probe_does_not_wedge_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    stub = ScriptedStub([(0, 503, {}), (1.0, 200, {}), (0, 200, {})])
+
+    async def scenario(client, url):
+        await client.post(url, json={})
+        assert breaker.state == OPEN
+        clock.now += 10
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.post(url, json={}), timeout=0.1)
+        # 被取消的探测记为失败，重新熔断；过了 reset_timeout 可以再次探测
+        assert breaker.state == OPEN
+        clock.now += 10
+        response = await client.post(url, json={})
+        return response.status_code, breaker.state
+
+    assert run(stub, scenario, max_retries=0, breaker=breaker) == (200, CLOSED)
+
+
+def test_transport_error_counts_as_failure():
+    breaker = CircuitBreaker(failure_threshold=1)
+
+    async def main():
+        pool = HTTPPool(connect_timeout=0.5)
+        client = ResilientClient(pool, max_retries=0, breaker=breaker)
+        try:
+            with pytest.raises(httpx.TransportError):
+                await client.post("http://127.0.0.1:9/chat", json={})
+        finally:
+            await pool.aclose()
+
+    asyncio.run(main())
+    assert breaker.state == OPEN
@@ -0,0 +1,174 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import msgpack
+
+from metrics import add_span_listener, remove_span_listener, trace_id_var
+
+logger = logging.getLogger(__name__)
+
+# 生成替代文本用的字符表：常用汉字区间，保持中文消息的长度和字符类型
+_CJK_START, _CJK_END = 0x4E00, 0x9FA5
+
+
+class Anonymizer:
+    """
+    把 Telegram 更新里的个人信息替换成带盐哈希：
+    - user / chat id 映射为稳定的匿名整数（同一个人在日志里仍是同一个 id）
+    - 消息文本替换为长度相同的伪文本，相同原文得到相同伪文本，保留重复率（缓存命中率才能复现）；
+      命令名保留，参数照样替换
+    - 只保留重放需要的字段，其余（姓名、用户名、附件等）全部丢弃
+    """
+
+    def __init__(self, salt):
+        self._salt = salt.encode("utf-8") if isinstance(salt, str) else salt
+
+    def _digest(self, value):
+        return hmac.new(self._salt, str(value).encode("utf-8"), hashlib.sha256).digest()
+
+    def user_id(self, value):
+        if value is None:
+            return None
+        anon = int.from_bytes(self._digest(value)[:6], "big")
+        # 群组 chat id 为负数，保留符号
+        return -anon if int(value) < 0 else anon
+
+    def text(self, value):
+        if not value:
+            return value
+        if value.startswith("/"):
+            command, _, args = value.partition(" ")
+            return f"{command} {self._pseudo(args)}" if args else command
+        return self._pseudo(value)
+
+    def _pseudo(self, value):
+        rng = random.Random(self._digest(value))
+        return "".join(
+            " " if ch.isspace() else chr(rng.randint(_CJK_START, _CJK_END)) if ord(ch) > 0x2E80
+            # 数字仍替换成数字：/maimai 的好友码参数重放时依然合法
+            else rng.choice("0123456789") if "0" <= ch <= "9"
+            else rng.choice("abcdefghijklmnopqrstuvwxyz0123456789")
+            for ch in value
+        )
+
+    def update(self, payload):
+        message = payload.get("message") or payload.get("edited_message")
+        if not message:
+            return {"update_id": payload.get("update_id"), "kind": "other"}
+        chat = message.get("chat") or {}
+        sender = message.get("from") or {}
+        anon_message = {
+            "message_id": message.get("message_id"),
+            "date": message.get("date"),
+            "chat": {"id": self.user_id(chat.get("id")), "type": chat.get("type", "private")},
+            "from": {"id": self.user_id(sender.get("id")), "is_bot": sender.get("is_bot", False), "first_name": "user"},
+        }
+        if "text" in message:
+            anon_message["text"] = self.text(message["text"])
+            entities = [e for e in message.get("entities", []) if e.get("type") == "bot_command"]
+            if entities:
+                anon_message["entities"] = entities
+        return {"update_id": payload.get("update_id"), "message": anon_message}
+
+
+class TrafficRecorder:
+    """
+    采集模式：把匿名化后的 webhook 更新和各阶段耗时（含上游响应时间）以 msgpack 流追加写入文件。
+    记录格式：
+        {"type": "update", "at": 接收时间戳, "update": {...}}
+        {"type": "span", "at": 时间戳, "trace": update_id, "stage": 阶段名, "seconds": 耗时}
+    写文件在后台线程进行，队列满时丢弃记录，不影响 webhook 响应。
+    sample_rate < 1 时按 update 抽样，只记录被抽中的更新及其阶段耗时。
+    """
+
+    def __init__(self, path, salt, sample_rate=1.0, max_queue=10000, clock=time.time):
+        self.path = path
+        self.anonymizer = Anonymizer(salt)
+        self.sample_rate = sample_rate
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._sampled = set()
+        self._thread = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+        self._thread.start()
+        add_span_listener(self._on_span)
+
+        self.updates = 0
+        self.spans = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        设置 TRAFFIC_CAPTURE_PATH 时开启采集；多工作进程部署时在路径里写 {pid}，每个进程各写一个文件。
+        TRAFFIC_CAPTURE_SALT 不设时每次启动随机生成（不同次采集之间的匿名 id 无法对应）。
+        """
+        path = os.getenv("TRAFFIC_CAPTURE_PATH")
+        if not path:
+            return None
+        return cls(
+            path.replace("{pid}", str(os.getpid())),
+            salt=os.getenv("TRAFFIC_CAPTURE_SALT") or os.urandom(16),
+            sample_rate=float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0")),
+        )
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_update(self, payload):
+        update_id = payload.get("update_id")
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        self._sampled.add(str(update_id))
+        if len(self._sampled) > 100000:
+            self._sampled.clear()
+        self.updates += 1
+        self._put({"type": "update", "at": self._clock(), "update": self.anonymizer.update(payload)})
+
+    def _on_span(self, stage, seconds):
+        trace = trace_id_var.get()
+        if trace not in self._sampled:
+            return
+        self.spans += 1
+        self._put({"type": "span", "at": self._clock(), "trace": trace, "stage": stage, "seconds": seconds})
+
+    def _write_loop(self):
+        packer = msgpack.Packer()
+        try:
+            with open(self.path, "ab") as f:
+                while True:
+                    record = self._queue.get()
+                    if record is None:
+                        return
+                    f.write(packer.pack(record))
+                    # 积压较少时及时落盘，进程被强制结束也只丢最后几条
+                    if self._queue.empty():
+                        f.flush()
+        except Exception as e:
+            logger.error(f"❌ Traffic capture stopped: {e}")
+
+    def close(self):
+        remove_span_listener(self._on_span)
+        try:
+            self._queue.put(None, timeout=5)
+        except queue.Full:
+            # 写线程已经退出，没人消费了
+            return
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        return {"updates": self.updates, "spans": self.spans, "dropped": self.dropped, "queue_depth": self._queue.qsize()}
+
+
+def read_records(path):
+    """按顺序读出采集文件里的全部记录"""
+    with open(path, "rb") as f:
+        yield from msgpack.Unpacker(f, raw=False)
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from metrics import new_trace_id, span
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+
+class UpdateDispatcher:
+    """
+    Webhook 更新的有界队列 + 工作协程池。
+    webhook 只负责入队并立即返回，工作协程在后台调用 process(update)。
+    - 同一个聊天的更新总是进入同一个工作协程的队列，保证按顺序处理
+    - 按 update_id 去重，Telegram 重发的更新不会被处理两次
+    - is_priority(update) 为真的更新（如 /help 这类轻量命令）不进队列，立即单独处理，
+      不会排在 LLM 调用后面
+    - 队列满时按 overflow 策略处理："backpressure" 拒绝（webhook 返回 503，让 Telegram 稍后重发），
+      "shed" 直接丢弃（webhook 仍返回 200）
+    - 一条更新最多占住工作协程 max_block 秒（例如上游卡住、重试），超时后转到后台继续处理，
+      工作协程接着处理队列里的下一条，不让同一队列上其他聊天一直等着
+    """
+
+    def __init__(self, process, num_workers=8, queue_size=100, dedupe_size=10000, overflow="backpressure",
+                 is_priority=None, max_block=20.0):
+        if overflow not in ("backpressure", "shed"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.process = process
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.dedupe_size = dedupe_size
+        self.overflow = overflow
+        self.is_priority = is_priority
+        self.max_block = max_block
+
+        self._queues = []
+        self._workers = []
+        self._seen = OrderedDict()
+        self._priority_tasks = set()
+        self._detached = set()
+
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.shed = 0
+        self.prioritized = 0
+        self.processed = 0
+        self.errors = 0
+        self.detached = 0
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.num_workers)]
+        self._workers = [asyncio.ensure_future(self._worker(q)) for q in self._queues]
+
+    @staticmethod
+    def _ordering_key(update):
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else update.update_id
+
+    def submit(self, update) -> str:
+        """非阻塞入队，返回 ACCEPTED / DUPLICATE / REJECTED"""
+        self._ensure_started()
+        if update.update_id in self._seen:
+            self.duplicates += 1
+            return DUPLICATE
+
+        if self.is_priority is not None and self.is_priority(update):
+            self._remember(update.update_id)
+            self.prioritized += 1
+            task = asyncio.ensure_future(self._process_one(update))
+            self._priority_tasks.add(task)
+            task.add_done_callback(self._priority_tasks.discard)
+            return ACCEPTED
+
+        queue = self._queues[hash(self._ordering_key(update)) % self.num_workers]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            if self.overflow == "shed":
+                self.shed += 1
+                logger.warning(f"⚠️ Update queue full, dropped update {update.update_id}")
+                self._remember(update.update_id)
+                return ACCEPTED
+            self.rejected += 1
+            return REJECTED
+
+        self._remember(update.update_id)
+        self.accepted += 1
+        return ACCEPTED
+
+    def _remember(self, update_id):
+        self._seen[update_id] = None
+        while len(self._seen) > self.dedupe_size:
+            self._seen.popitem(last=False)
+
+    async def _worker(self, queue):
+        while True:
+            update = await queue.get()
+            if update is None:
+                return
+            try:
+                task = asyncio.ensure_future(self._process_one(update))
+                done, _ = await asyncio.wait({task}, timeout=self.max_block)
+                if not done:
+                    # 放到后台继续处理；这个聊天之后的更新可能先于它完成
+                    self.detached += 1
+                    logger.warning(f"⚠️ Update {update.update_id} still running after {self.max_block:.0f}s, detached")
+                    self._detached.add(task)
+                    task.add_done_callback(self._detached.discard)
+            finally:
+                queue.task_done()
+
+    async def _process_one(self, update):
+        # 用 update_id 作为 trace ID，处理过程中的日志都能关联到这条更新
+        new_trace_id(update.update_id)
+        try:
+            with span("update"):
+                await self.process(update)
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error processing update {update.update_id}: {str(e)}")
+
+    @property
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    async def aclose(self):
+        """处理完已入队的更新后停止工作协程"""
+        for queue in self._queues:
+            await queue.put(None)
+        if self._workers or self._priority_tasks:
+            await asyncio.gather(*self._workers, *self._priority_tasks, return_exceptions=True)
+        if self._detached:
+            await asyncio.gather(*self._detached, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "prioritized": self.prioritized,
+            "processed": self.processed,
+            "errors": self.errors,
+            "detached": self.detached,
+            "detached_in_flight": len(self._detached),
+        }
@@ -0,0 +1,227 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class UpstreamUnavailable(Exception):
+    """熔断器打开，上游被判定为不可用"""
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后熔断（OPEN），reset_timeout 秒内直接失败；
+    之后进入 HALF_OPEN，只放行一个探测请求，成功则恢复，失败则继续熔断。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self._clock() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = self._clock()
+
+
+class LatencyTracker:
+    """保留最近若干次成功请求的耗时，用来估计 p95"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def parse_retry_after(response):
+    """解析 Retry-After（秒数或 HTTP 日期），无法解析时返回 None"""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ResilientClient:
+    """
+    带超时、重试、对冲请求和熔断的上游客户端（包装 HTTPPool）。
+    - 429/5xx 和网络错误按带抖动的指数退避重试，有 Retry-After 时按它等待
+    - hedge=True 时，第一个请求超过最近 p95 耗时还没返回，就再发一个相同请求，取先返回的
+    - 最终仍失败则计入熔断器；熔断期间直接抛出 UpstreamUnavailable
+    """
+
+    def __init__(self, pool, connect_timeout=5.0, read_timeout=60.0, max_retries=2, base_backoff=0.5,
+                 max_backoff=8.0, max_retry_after=30.0, hedge=False, hedge_min_delay=1.0, hedge_min_samples=20,
+                 breaker=None):
+        self.pool = pool
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+
+        self.requests = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _backoff(self, attempt, response):
+        retry_after = parse_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        # full jitter
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    async def _timed_post(self, url, kwargs):
+        started = time.monotonic()
+        response = await self.pool.post(url, timeout=self.timeout, **kwargs)
+        if response.status_code < 500:
+            self.latency.record(time.monotonic() - started)
+        return response
+
+    async def _send(self, url, kwargs):
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return await self._timed_post(url, kwargs)
+
+        delay = max(self.hedge_min_delay, self.latency.percentile(0.95))
+        primary = asyncio.ensure_future(self._timed_post(url, kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.hedged += 1
+        backup = asyncio.ensure_future(self._timed_post(url, kwargs))
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def post(self, url, **kwargs) -> httpx.Response:
+        """发送 POST；返回最后一次的响应（可能仍是错误状态码），网络错误重试耗尽时抛出原异常"""
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(url)
+
+        self.requests += 1
+        response, error = None, None
+        succeeded = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response, error = await self._send(url, kwargs), None
+                except httpx.TransportError as e:
+                    response, error = None, e
+                if response is not None and response.status_code not in RETRY_STATUSES:
+                    succeeded = True
+                    return response
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(self._backoff(attempt, response))
+        finally:
+            # 被取消或抛出其他异常时也要给熔断器一个结果，否则 HALF_OPEN 的探测名额永远不会释放
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+        if error is not None:
+            raise error
+        return response
+
+    @asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        """流式请求不重试（已经输出的内容无法撤回），只做熔断检查和结果记录"""
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(url)
+        self.requests += 1
+        recorded = False
+        try:
+            async with self.pool.stream(method, url, timeout=self.timeout, **kwargs) as response:
+                recorded = True
+                if response.status_code in RETRY_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                yield response
+        finally:
+            # 拿到响应之前出错或被取消
+            if not recorded:
+                self.breaker.record_failure()
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "breaker_open": int(self.breaker.state != CLOSED),
+            "breaker_rejected": self.breaker.rejected,
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p95_seconds": self.latency.percentile(0.95) or 0.0,
+        }